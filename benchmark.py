@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Offline stand-in for the PhET API and an end-to-end benchmark of the chef.
+
+Record a small slice of the live API once:
+
+    python benchmark.py record --lang en --sims 20
+
+then time the chef against the recorded fixtures, without touching
+phet-api.colorado.edu or phet.colorado.edu:
+
+    python benchmark.py run --lang en --latency 0.05 --workers 4 --json bench.json
+
+`serve` starts the stand-in on its own, e.g. to point a full chef run at it
+with `PHET_API_URL` and `PHET_DOWNLOAD_URL`. `memory` measures the memory
+needed to load the recorded simulations listing, optionally replicated to
+stand in for a larger catalog:
+
+    python benchmark.py memory --lang en --scale 10
+"""
+
+import argparse
+import functools
+import gc
+import io
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+
+import requests
+
+FIXTURES_DIR = 'chefdata/bench_fixtures'
+LIVE_API_URL = 'https://phet-api.colorado.edu'
+LIVE_DOWNLOAD_URL = 'https://phet.colorado.edu'
+
+
+def fixture_path(fixtures_dir, path):
+    """
+    Return the fixture file for a request path (including its query string).
+    """
+    return os.path.join(fixtures_dir, quote(path, safe=''))
+
+
+def catalog_path(fixtures_dir, language):
+    """
+    Return the file holding the untrimmed simulations listing recorded for `language`.
+    """
+    return os.path.join(fixtures_dir, 'catalog_{}.json'.format(language))
+
+
+def record_fixtures(fixtures_dir, language, sim_count):
+    """
+    Save the metadata listings for `language`, trimmed to the first `sim_count` sims,
+    together with the detail payload and HTML of each of those sims. The full simulations
+    listing is kept as well for the memory benchmark.
+    """
+    os.makedirs(fixtures_dir, exist_ok=True)
+
+    def save(path, content):
+        with open(fixture_path(fixtures_dir, path), 'wb') as f:
+            f.write(content)
+        print("Recorded", path, len(content), "bytes")
+
+    def fetch(base_url, path):
+        response = requests.get(base_url + path, timeout=(10, 120))
+        response.raise_for_status()
+        return response.content
+
+    sims_path = '/partner-services/2.0/metadata/simulations?locale=' + language
+    content = fetch(LIVE_API_URL, sims_path)
+    with open(catalog_path(fixtures_dir, language), 'wb') as f:
+        f.write(content)
+    sim_data = json.loads(content)
+    sim_data['simulations'] = sim_data['simulations'][:sim_count]
+    save(sims_path, json.dumps(sim_data).encode('utf-8'))
+    path = '/partner-services/2.0/metadata/categories?locale=' + language
+    save(path, fetch(LIVE_API_URL, path))
+
+    for sim in sim_data['simulations']:
+        path = '/partner-services/2.0/metadata/simulations/{}?locale={}'.format(sim['id'], language)
+        save(path, fetch(LIVE_API_URL, path))
+        run_url = sim['defaultData']['runUrl']
+        localized = (sim.get('localizedData') or {}).get(language)
+        if localized and localized.get('runUrl'):
+            run_url = localized['runUrl']
+        path = run_url + '?download'
+        save(path, fetch(LIVE_DOWNLOAD_URL, path))
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    fixtures_dir = FIXTURES_DIR
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        path = fixture_path(self.fixtures_dir, self.path)
+        if not os.path.exists(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            content = f.read()
+        content_type = 'text/html; charset=utf-8' if '.html' in self.path else 'application/json'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_standin(fixtures_dir, latency=0.0, port=0):
+    """
+    Serve the recorded fixtures on localhost from a background thread. Every request
+    waits `latency` seconds before it is answered. Returns the server and its base URL.
+    """
+    handler = type('Handler', (StandinHandler,), {'fixtures_dir': fixtures_dir, 'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+class OfflineTranslator(object):
+    """
+    Stands in for `GoogleTranslator`: "translates" a string by tagging it with the target
+    language, after the stand-in's latency.
+    """
+
+    def __init__(self, source='auto', target='en', latency=0.0):
+        self.source = source
+        self.target = target
+        self.latency = latency
+
+    def translate(self, text, **kwargs):
+        time.sleep(self.latency)
+        return '[{}] {}'.format(self.target, text)
+
+
+class StageTimer(object):
+    """
+    Wraps functions to count their calls and wall time. Re-entrant calls (the recursion
+    in download_category) are only counted once, at the outermost call.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stages = {}
+
+    def wrap(self, name, fn):
+        def timed(*args, **kwargs):
+            depth = getattr(self.local, name, 0)
+            setattr(self.local, name, depth + 1)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                setattr(self.local, name, depth)
+                if depth == 0:
+                    elapsed = time.perf_counter() - start
+                    with self.lock:
+                        calls, total = self.stages.get(name, (0, 0.0))
+                        self.stages[name] = (calls + 1, total + elapsed)
+        return timed
+
+
+def run_benchmark(fixtures_dir, language, latency, workers):
+    """
+    Run `construct_channel` against the stand-in with empty caches, an `OfflineTranslator` and
+    all its files in a temporary directory, and return the report.
+    """
+    server, base_url = start_standin(fixtures_dir, latency=latency)
+    os.environ['PHET_API_URL'] = base_url
+    os.environ['PHET_DOWNLOAD_URL'] = base_url
+    import chef
+    from build_manifest import BuildManifest
+    from thumbnails import ThumbnailStore
+    from videos import VideoStore
+
+    # measure the network as it is, not the HTTP cache
+    for prefix, name, heuristic in chef.cache_policies:
+        chef.sess.mount(prefix, chef.adapter)
+
+    traffic = {'requests': 0, 'bytes': 0}
+    traffic_lock = threading.Lock()
+
+    def count_traffic(response, *args, **kwargs):
+        with traffic_lock:
+            traffic['requests'] += 1
+            traffic['bytes'] += int(response.headers.get('Content-Length') or 0) if kwargs.get('stream') \
+                else len(response.content)
+    chef.sess.hooks['response'].append(count_traffic)
+
+    timer = StageTimer()
+    chef_class = chef.PhETSushiChef
+    for name in ['construct_channel', 'download_category', 'download_sim']:
+        setattr(chef_class, name, timer.wrap(name, getattr(chef_class, name)))
+    chef.process_sim_html = timer.wrap('process_sim_html', chef.process_sim_html)
+
+    workdir = tempfile.mkdtemp(prefix='phet-bench-')
+    try:
+        sushi_chef = chef_class()
+        sushi_chef.manifest = BuildManifest(
+            path=os.path.join(workdir, 'build_manifest.json'), zip_dir=os.path.join(workdir, 'zips'))
+        sushi_chef.journal_path = os.path.join(workdir, 'journal_{}.jsonl')
+        sushi_chef.report_path = os.path.join(workdir, 'run_report_{}.json')
+        sushi_chef.video_store = VideoStore(directory=os.path.join(workdir, 'videos'), get=chef.sess.get)
+        sushi_chef.thumbnail_store = ThumbnailStore(directory=os.path.join(workdir, 'thumbnails'), get=chef.sess.get)
+        # a cold run: no translation memory, and no translation service either
+        sushi_chef.translation_memory_path = os.path.join(workdir, 'translation_memory.json')
+        sushi_chef.translator_class = functools.partial(OfflineTranslator, latency=latency)
+        start = time.perf_counter()
+        # primer videos and sim images are not recorded, so they are left for ricecooker to download
+        channel = sushi_chef.construct_channel(lang=language, workers=workers, video_workers=0, thumbnail_workers=0)
+        wall_time = time.perf_counter() - start
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        server.shutdown()
+
+    return {
+        'language': language,
+        'latency': latency,
+        'workers': workers,
+        'sims': len(sushi_chef.sim_records),
+        'nodes': channel.count(),
+        'requests': traffic['requests'],
+        'bytes': traffic['bytes'],
+        'wall_time': wall_time,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peak_rss_children_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        'stages': {name: {'calls': calls, 'seconds': total} for name, (calls, total) in timer.stages.items()},
+        'chef_stages': sushi_chef.report.stages,
+    }
+
+
+def measure_memory(load):
+    """
+    Call `load` and return the bytes it allocated that are still alive once it returns
+    (kept alive by its result) and the peak allocated while it ran.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load()
+    seconds = time.perf_counter() - start
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {'retained': retained, 'peak': peak, 'seconds': seconds}
+
+
+def memory_benchmark(fixtures_dir, language, scale=1):
+    """
+    Compare the memory taken by loading the simulations listing the way the chef used to
+    (decoded text, full object tree and a dict of complete sims, all alive for the whole
+    build) with the compact catalog of `catalog.load_sims`. The listing is the recorded
+    full catalog if there is one, with its sims repeated `scale` times under new ids.
+    """
+    import catalog
+
+    path = catalog_path(fixtures_dir, language)
+    if not os.path.exists(path):
+        path = fixture_path(fixtures_dir, '/partner-services/2.0/metadata/simulations?locale=' + language)
+    with open(path, 'rb') as f:
+        sim_data = json.load(f)
+    sims = sim_data['simulations']
+    id_step = max(sim['id'] for sim in sims) + 1
+    sim_data['simulations'] = [dict(sim, id=sim['id'] + copy * id_step) for copy in range(scale) for sim in sims]
+    content = json.dumps(sim_data).encode('utf-8')
+    del sim_data, sims
+
+    def full_tree():
+        sim_data = json.loads(content.decode('utf-8'))
+        return sim_data, {sim['id']: sim for sim in sim_data['simulations']}
+
+    def compact():
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = io.BytesIO(content)
+        return catalog.load_sims(response, language)
+
+    return {
+        'language': language,
+        'sims': len(compact()),
+        'bytes': len(content),
+        'parser': 'ijson ({})'.format(catalog.ijson.backend) if catalog.ijson else 'json',
+        'full_tree': measure_memory(full_tree),
+        'compact': measure_memory(compact),
+    }
+
+
+def print_memory_report(report):
+    print("{language}: simulations listing of {sims} sims, {:.1f} MB".format(report['bytes'] / 1024 ** 2, **report))
+    for name, label in [('full_tree', 'json.loads(text)'), ('compact', 'load_sims, ' + report['parser'])]:
+        stats = report[name]
+        print("\t{:<26} {:>8.1f} MB retained {:>8.1f} MB peak {:>7.2f}s".format(
+            label, stats['retained'] / 1024 ** 2, stats['peak'] / 1024 ** 2, stats['seconds']))
+
+
+def print_report(report):
+    print("{language}: {sims} sims, {nodes} nodes in {wall_time:.2f}s "
+          "({workers} workers, {latency}s latency)".format(**report))
+    print("\t{requests} requests, {:.1f} MB, peak RSS {:.0f} MB (zip processes {:.0f} MB)".format(
+        report['bytes'] / 1024 ** 2, report['peak_rss_kb'] / 1024, report['peak_rss_children_kb'] / 1024,
+        requests=report['requests']))
+    for name, stage in sorted(report['stages'].items(), key=lambda item: -item[1]['seconds']):
+        print("\t{:<20} {:>6} calls {:>9.2f}s {:>9.1f}ms/call".format(
+            name, stage['calls'], stage['seconds'], 1000 * stage['seconds'] / stage['calls']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['record', 'serve', 'run', 'memory'])
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='Directory of recorded responses.')
+    parser.add_argument('--lang', default='en', help='Language to record or build.')
+    parser.add_argument('--sims', type=int, default=20, help='Number of sims to record.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the stand-in waits per request.')
+    parser.add_argument('--port', type=int, default=8000, help='Port for `serve`.')
+    parser.add_argument('--workers', type=int, default=1, help='Value of the chef\'s --workers option.')
+    parser.add_argument('--scale', type=int, default=1, help='For `memory`, how many times to repeat the catalog.')
+    parser.add_argument('--json', help='Also write the benchmark report to this file.')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record_fixtures(args.fixtures, args.lang, args.sims)
+    elif args.command == 'serve':
+        server, base_url = start_standin(args.fixtures, latency=args.latency, port=args.port)
+        print("Serving {} on {}".format(args.fixtures, base_url))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        if args.command == 'memory':
+            report = memory_benchmark(args.fixtures, args.lang, args.scale)
+            print_memory_report(report)
+        else:
+            report = run_benchmark(args.fixtures, args.lang, args.latency, args.workers)
+            print_report(report)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Manifest of the HTML5 zips built by previous runs.
+
+For every sim and language the manifest records the runUrl the sim was built
+from, the hash of the `process_sim_html` rules and of the processed
+`index.html`, and where the zip was stored. A sim whose runUrl and rules are
+unchanged since the last run reuses its zip instead of being downloaded and
+rewritten again.
+"""
+
+import json
+import os
+import threading
+
+BUILD_MANIFEST_PATH = 'chefdata/build_manifest.json'
+ZIP_STORE_DIR = 'chefdata/zips'
+
+
+class BuildManifest(object):
+
+    def __init__(self, path=BUILD_MANIFEST_PATH, zip_dir=ZIP_STORE_DIR):
+        self.path = path
+        self.zip_dir = zip_dir
+        self.lock = threading.Lock()
+        self.reused = 0
+        self.built = 0
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(sim_id, language):
+        return '{}/{}'.format(sim_id, language)
+
+    def get_entry(self, sim_id, language, run_url, rules_hash):
+        """
+        Return the manifest entry for the sim if it was built from the same `run_url`
+        with the same rewrite rules and its zip is still on disk, otherwise None.
+        """
+        entry = self.entries.get(self.key(sim_id, language))
+        if not entry or entry['run_url'] != run_url or entry['rules_hash'] != rules_hash:
+            return None
+        if not os.path.exists(entry['zippath']):
+            return None
+        with self.lock:
+            self.reused += 1
+        return entry
+
+    def new_zip_path(self, run_url, language):
+        """
+        Return the path in the zip store where the zip for `run_url` is to be written.
+        """
+        name = os.path.splitext(os.path.basename(run_url))[0]
+        zippath = os.path.join(self.zip_dir, language, '{}.zip'.format(name))
+        os.makedirs(os.path.dirname(zippath), exist_ok=True)
+        with self.lock:
+            self.built += 1
+        return zippath
+
+    def reset_counts(self):
+        with self.lock:
+            self.reused = 0
+            self.built = 0
+
+    def record(self, sim_id, language, run_url, rules_hash, html_hash, zippath):
+        with self.lock:
+            self.entries[self.key(sim_id, language)] = {
+                'run_url': run_url,
+                'rules_hash': rules_hash,
+                'html_hash': html_hash,
+                'zippath': zippath,
+            }
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    def print_summary(self):
+        print("Sim zips: {} reused from {}, {} built".format(self.reused, self.path, self.built))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compact, per-language view of the PhET simulations listing.
+
+The listing carries every sim's data in every locale, but a build only reads a
+handful of fields in one language. `load_sims` parses the listing straight
+from the response bytes, one sim at a time with ijson when it is installed,
+and keeps a slotted `SimRecord` per sim with just those fields, so neither the
+decoded text nor the full object tree stays in memory.
+"""
+
+import json
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+class SimRecord(object):
+    """
+    The fields of a sim the chef reads, with its localized runUrl, title and description
+    already applied over the defaults.
+    """
+
+    __slots__ = ('id', 'run_url', 'title', 'description', 'image_url', 'localized')
+
+    def __init__(self, id, run_url, title, description, image_url, localized):
+        self.id = id
+        self.run_url = run_url
+        self.title = title
+        self.description = description
+        self.image_url = image_url
+        # whether the listing has data for the language, i.e. the title is not to be translated
+        self.localized = localized
+
+    @classmethod
+    def from_json(cls, sim, language):
+        default_data = sim.get('defaultData') or {}
+        localized = (sim.get('localizedData') or {}).get(language) or {}
+        return cls(
+            id=sim['id'],
+            run_url=localized.get('runUrl') or default_data.get('runUrl'),
+            title=localized.get('title') or default_data.get('title'),
+            description=localized.get('description') or default_data.get('description'),
+            image_url=get_image_url(default_data.get('simImages') or []),
+            localized=bool(localized),
+        )
+
+
+def get_image_url(sim_images, width=128):
+    """
+    Return the URL of the image `width` pixels wide, or of the first image if there is none.
+    """
+    for image in sim_images:
+        if image.get('width') == width:
+            return image.get('url')
+    return sim_images[0].get('url') if sim_images else None
+
+
+def load_sims(response, language):
+    """
+    Return {sim id: SimRecord} for the simulations listing in `response`, which should
+    have been requested with `stream=True` so its body can be parsed as it is read.
+    """
+    # an error page would otherwise only fail deep in the JSON parser
+    response.raise_for_status()
+    if ijson is None:
+        # parse the bytes, skipping the decoded text copy of `response.text`
+        data = json.loads(response.content)
+        return {sim['id']: SimRecord.from_json(sim, language) for sim in data['simulations']}
+    response.raw.decode_content = True
+    sims = {}
+    for sim in ijson.items(response.raw, 'simulations.item'):
+        sims[sim['id']] = SimRecord.from_json(sim, language)
+    # read what the parser left, so the HTTP cache stores the whole response
+    response.raw.read()
+    response.close()
+    return sims
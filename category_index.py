@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Flattened view of the PhET categories payload.
+
+The index is built once per language from the categories response: the
+parent/child maps with the blacklist already applied, the set of leaf
+categories (the only ones whose sims are added to the channel) and, for each
+sim, the leaf categories it appears in. `select` uses it to restrict a build
+to some category subtrees or sims.
+"""
+
+ROOT_CATEGORY_ID = 1
+
+
+class CategoryIndex(object):
+
+    def __init__(self, categories, blacklist, root_id=ROOT_CATEGORY_ID):
+        self.categories = categories
+        self.root_id = root_id
+        # category id -> child ids that are not blacklisted, in the API's order
+        self.children = {}
+        # category id -> ids of the categories listing it as a child
+        self.parents = {}
+        self.leaves = set()
+        # sim id -> leaf category ids listing it
+        self.sim_categories = {}
+
+        stack = [root_id]
+        while stack:
+            cat_id = stack.pop()
+            if cat_id in self.children:
+                continue
+            child_ids = [child_id for child_id in categories[str(cat_id)]["childrenIds"]
+                         if categories[str(child_id)]["name"] not in blacklist]
+            self.children[cat_id] = child_ids
+            for child_id in child_ids:
+                self.parents.setdefault(child_id, set()).add(cat_id)
+                stack.append(child_id)
+            if not child_ids:
+                self.leaves.add(cat_id)
+                for sim_id in categories[str(cat_id)]["simulationIds"]:
+                    self.sim_categories.setdefault(sim_id, []).append(cat_id)
+
+    def find(self, id_or_name):
+        """
+        Return the ids of the indexed categories whose id or name is `id_or_name`.
+        """
+        return [cat_id for cat_id in self.children
+                if str(cat_id) == str(id_or_name) or self.categories[str(cat_id)]["name"] == id_or_name]
+
+    def ancestors(self, cat_id):
+        seen = set()
+        stack = list(self.parents.get(cat_id, []))
+        while stack:
+            parent_id = stack.pop()
+            if parent_id not in seen:
+                seen.add(parent_id)
+                stack.extend(self.parents.get(parent_id, []))
+        return seen
+
+    def descendants(self, cat_id):
+        stack = list(self.children.get(cat_id, []))
+        while stack:
+            child_id = stack.pop()
+            yield child_id
+            stack.extend(self.children.get(child_id, []))
+
+    def select(self, only_categories=None, only_sims=None):
+        """
+        Return the set of category ids to build when restricting the channel to the subtrees
+        of `only_categories` (ids or names) and/or to the sims in `only_sims`, or None to
+        build everything. The path from the root to every selected category is kept.
+        Raises a ValueError for categories or sims that are not in the index, and if the
+        filters together select nothing, rather than building an empty channel.
+        """
+        if not only_categories and not only_sims:
+            return None
+        selected = set(self.children)
+        if only_categories:
+            unknown = [id_or_name for id_or_name in only_categories if not self.find(id_or_name)]
+            if unknown:
+                raise ValueError("No category {} to build".format(", ".join(map(str, unknown))))
+            selected = set()
+            for id_or_name in only_categories:
+                for cat_id in self.find(id_or_name):
+                    selected.add(cat_id)
+                    selected.update(self.ancestors(cat_id))
+                    selected.update(self.descendants(cat_id))
+        if only_sims:
+            unknown = [sim_id for sim_id in only_sims if sim_id not in self.sim_categories]
+            if unknown:
+                raise ValueError("Sims {} are in no category to build".format(", ".join(map(str, unknown))))
+            sim_paths = set()
+            for sim_id in only_sims:
+                for cat_id in self.sim_categories[sim_id]:
+                    sim_paths.add(cat_id)
+                    sim_paths.update(self.ancestors(cat_id))
+            selected &= sim_paths
+        if not selected & self.leaves:
+            raise ValueError("Categories {} contain none of the sims {}".format(
+                ", ".join(map(str, only_categories)), ", ".join(map(str, only_sims))))
+        return selected
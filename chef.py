@@ -1,46 +1,72 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import argparse
+import hashlib
+import inspect
 import os
 import json
 import re
-import requests
 import tempfile
-
-from bs4 import BeautifulSoup
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
 
 from ricecooker.chefs import SushiChef
 from ricecooker.classes.files import HTMLZipFile, VideoFile
 from ricecooker.classes.licenses import CC_BYLicense
 from ricecooker.classes.nodes import ChannelNode, HTML5AppNode, TopicNode, VideoNode
-from ricecooker.utils.caching import CacheForeverHeuristic, FileCache, CacheControlAdapter
-from ricecooker.utils.html import download_file
-from ricecooker.utils.zip import create_predictable_zip
+from ricecooker.utils.zip import write_file_to_zip_with_neutral_metadata
 from le_utils.constants import roles
 from le_utils.constants.languages import getlang
-from requests.packages.urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
 
+from cachecontrol.heuristics import ExpiresAfter
 from deep_translator import GoogleTranslator
+from build_manifest import BuildManifest
+from catalog import load_sims
+from category_index import CategoryIndex
 from metadata_tags import METADATA_BY_CAT
+from prefetch import PREFETCH_MAX_WORKERS, prefetch_json
+from resilience import BREAKER_THRESHOLD, ResilientSession, get_timeouts
+from run_report import RUN_REPORT_PATH, RunReport
+from sim_results import (
+    SHARD_DIR, ResultLog, make_result, parse_shard, read_shard_results, shard_of, shard_results_path)
+from sim_rewrites import DOCUMENT_REWRITES, PHET_WEBSITE_REMOVALS, rewrite_sim_html
+from string_bundles import prune_string_bundles
+from thumbnails import THUMBNAIL_MAX_WORKERS, ThumbnailStore
+from translation import TRANSLATION_MEMORY_PATH, TranslationMemory
+from videos import VideoStore, select_rendition
+from webcache import LRUFileCache, WEBCACHE_DIR, get_cache_policies, mount_cache
+
+ID_BLACKLIST_BY_LANG = {
+    'en': ["html", "by-device", "new", "quantum", "general"],
+    'ar': ["html", "by-device", "new", "quantum", "general", "by-level"]
+}
+
+BASE_URL = os.environ.get("PHET_API_URL", "https://phet-api.colorado.edu")
+BASE_URL_DOWNLOAD = os.environ.get("PHET_DOWNLOAD_URL", "https://phet.colorado.edu")
 
-retry_strategy = Retry(
+# every request gets its endpoint's timeouts, and metadata requests can be hedged (--hedge-after)
+sess = ResilientSession(
+    timeouts=get_timeouts(BASE_URL, BASE_URL_DOWNLOAD),
+    hedge_prefixes=[f"{BASE_URL}/partner-services/2.0/metadata/"],
+)
+# reports every failed attempt to the session's circuit breaker
+retry_strategy = sess.retry(
     total=5,
     backoff_factor=1
 )
-adapter = HTTPAdapter(max_retries=retry_strategy)
+# enough keep-alive connections per host for the prefetch and download workers
+POOL_MAXSIZE = 32
+adapter = HTTPAdapter(max_retries=retry_strategy, pool_maxsize=POOL_MAXSIZE)
 
-sess = requests.Session()
-cache = FileCache('.webcache')
 sess.mount('http://', adapter)
 sess.mount('https://', adapter)
-ID_BLACKLIST_BY_LANG = {
-    'en': ["html", "by-device", "new", "quantum", "general"],
-    'ar': ["html", "by-device", "new", "quantum", "general", "by-level"]
-}
-
-BASE_URL = "https://phet-api.colorado.edu"
-BASE_URL_DOWNLOAD = "https://phet.colorado.edu"
+cache = LRUFileCache(WEBCACHE_DIR)
+cache_policies = get_cache_policies(BASE_URL, BASE_URL_DOWNLOAD)
+cache_stats = mount_cache(sess, cache, cache_policies, retry_strategy, pool_maxsize=POOL_MAXSIZE)
 
 ARABIC_NAME_CATEGORY = {
     "Physics": "الفيزياء",
@@ -117,6 +143,8 @@ CHANNEL_LANGUAGE = "en"  # Language of channel
 CHANNEL_THUMBNAIL = 'chefdata/phet-logo-TM-partners.png'
 pdf_sheet_name = 'Sheet2'
 EXCEL_PATH = 'phet-metadata.xlsx'
+TREE_JSON_PATH = 'chefdata/tree_{}.json'
+JOURNAL_PATH = 'chefdata/journal_{}.jsonl'
 
 
 class PhETSushiChef(SushiChef):
@@ -133,6 +161,248 @@ class PhETSushiChef(SushiChef):
 
     # lang_en_translator = None
 
+    def __init__(self, *args, **kwargs):
+        super(PhETSushiChef, self).__init__(*args, **kwargs)
+        self.arg_parser = argparse.ArgumentParser(
+            description="Upload the PhET simulations to Kolibri Studio.",
+            add_help=True,
+            parents=[self.arg_parser],
+        )
+        self.arg_parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of sims to download, rewrite and zip in parallel.",
+        )
+        self.arg_parser.add_argument(
+            "--only-category",
+            action="append",
+            help="Only build the subtree of this category (id or name, e.g. chemistry); can be repeated.",
+        )
+        self.arg_parser.add_argument(
+            "--only-sim",
+            action="append",
+            type=int,
+            help="Only build the topics containing this sim id; can be repeated.",
+        )
+        self.arg_parser.add_argument(
+            "--prefetch-workers",
+            type=int,
+            default=PREFETCH_MAX_WORKERS,
+            help="Maximum number of sim detail requests in flight during the prefetch (0 to disable).",
+        )
+        self.arg_parser.add_argument(
+            "--thumbnail-workers",
+            type=int,
+            default=THUMBNAIL_MAX_WORKERS,
+            help="Number of sim thumbnails fetched in parallel into chefdata/thumbnails (0 to let ricecooker "
+                 "fetch and derive them).",
+        )
+        self.arg_parser.add_argument(
+            "--video-workers",
+            type=int,
+            default=4,
+            help="Number of primer videos downloaded in parallel into chefdata/videos (0 to let ricecooker "
+                 "download them from Vimeo).",
+        )
+        self.arg_parser.add_argument(
+            "--video-max-mb",
+            type=float,
+            default=None,
+            help="Use the best primer video rendition no larger than this many MB.",
+        )
+        self.arg_parser.add_argument(
+            "--video-max-kbps",
+            type=float,
+            default=None,
+            help="Use the best primer video rendition below this bitrate.",
+        )
+        self.arg_parser.add_argument(
+            "--zip-workers",
+            type=int,
+            default=None,
+            help="Number of processes compressing sim zips (defaults to the number of CPUs).",
+        )
+        self.arg_parser.add_argument(
+            "--keep-staging",
+            action="store_true",
+            help="Also write each processed index.html to a staging directory that is kept for debugging.",
+        )
+        self.arg_parser.add_argument(
+            "--cache-max-mb",
+            type=int,
+            default=None,
+            help="Size cap of the {} HTTP cache; least recently used entries are evicted.".format(WEBCACHE_DIR),
+        )
+        self.arg_parser.add_argument(
+            "--metadata-ttl-hours",
+            type=float,
+            default=None,
+            help="How long cached metadata listings are reused before being fetched again.",
+        )
+        self.arg_parser.add_argument(
+            "--strip-locales",
+            action="store_true",
+            help="Remove the strings of all languages but the channel's and English from the sims.",
+        )
+        self.arg_parser.add_argument(
+            "--rebuild-zips",
+            action="store_true",
+            help="Download and rewrite every sim even if the build manifest has an up-to-date zip.",
+        )
+        self.arg_parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the journal of an interrupted run and process every sim again.",
+        )
+        self.arg_parser.add_argument(
+            "--tree-only",
+            action="store_true",
+            help="Only build the topic/sim tree from the metadata and write it as JSON, without downloading, "
+                 "zipping or uploading anything.",
+        )
+        self.arg_parser.add_argument(
+            "--tree-json",
+            default=None,
+            help="Where --tree-only writes the tree (defaults to {}).".format(TREE_JSON_PATH.format("<lang>")),
+        )
+        self.arg_parser.add_argument(
+            "--shard",
+            default=None,
+            help="Only download and zip the sims of shard i/N (i from 0 to N-1) into --shard-dir, for a later "
+                 "--merge; nothing is uploaded.",
+        )
+        self.arg_parser.add_argument(
+            "--shard-dir",
+            default=SHARD_DIR,
+            help="Directory shared by the --shard builds and the --merge step.",
+        )
+        self.arg_parser.add_argument(
+            "--merge",
+            action="store_true",
+            help="Build the channel from the results of all the shards in --shard-dir instead of downloading sims.",
+        )
+        self.arg_parser.add_argument(
+            "--hedge-after",
+            type=float,
+            default=None,
+            help="Send a duplicate of metadata requests that have not answered after this many seconds, and use "
+                 "whichever answers first.",
+        )
+        self.arg_parser.add_argument(
+            "--breaker-mode",
+            choices=["pause", "fail"],
+            default="pause",
+            help="Whether to pause requests to a host that is down until it may be back, or to fail the run.",
+        )
+        self.arg_parser.add_argument(
+            "--breaker-threshold",
+            type=int,
+            default=BREAKER_THRESHOLD,
+            help="Number of failed attempts in a row, retries included, after which a host is considered down.",
+        )
+        self.arg_parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="Do not read or write the HTTP cache during this run.",
+        )
+        self.download_lock = threading.Lock()
+        self.locks = {}
+        self.sim_jobs = []
+        self.sim_records = {}
+        # the records taken from the journal or the shard results rather than built this run
+        self.loaded_records = set()
+        self.sim_details = {}
+        self.sim_detail_requests_saved = 0
+        self.topics = []
+        self.category_index = None
+        self.selected_categories = None
+        self.selected_sims = None
+        self.packager = None
+        self.zip_futures = []
+        self.dict_downloaded_paths = {}
+        self.manifest = BuildManifest()
+        self.report = None
+        self.video_store = VideoStore(get=sess.get)
+        self.video_paths = {}
+        self.thumbnail_store = ThumbnailStore(get=sess.get)
+        self.thumbnail_paths = {}
+        self.video_max_bytes = None
+        self.video_max_kbps = None
+        self.tree_only = False
+        self.shard = None
+        self.merging = False
+        self.strip_locales = False
+        self.rules_hash = REWRITE_RULES_HASH
+        self.string_savings = {}
+        self.result_logs = []
+        self.logged_results = set()
+        self.journal_path = JOURNAL_PATH
+        self.report_path = RUN_REPORT_PATH
+        self.translation_memory_path = TRANSLATION_MEMORY_PATH
+        self.translator_class = GoogleTranslator
+        self.sim_downloads = 0
+        self.journal = None
+        self.journaled = set()
+        sess.hooks['response'].append(self.record_response)
+
+    def record_response(self, response, *args, **kwargs):
+        if self.report:
+            self.report.record_response(response, **kwargs)
+        return response
+
+    def pre_run(self, args, options):
+        sess.hedge_delay = args.get("hedge_after")
+        sess.breaker.mode = args.get("breaker_mode") or "pause"
+        sess.breaker.threshold = args.get("breaker_threshold") or BREAKER_THRESHOLD
+        if args.get("no_cache"):
+            for prefix, name, heuristic in cache_policies:
+                sess.mount(prefix, adapter)
+        if args.get("cache_max_mb"):
+            cache.max_bytes = args["cache_max_mb"] * 1024 ** 2
+        if args.get("metadata_ttl_hours") is not None:
+            for prefix, name, heuristic in cache_policies:
+                if name == 'metadata':
+                    sess.adapters[prefix].heuristic = ExpiresAfter(hours=args["metadata_ttl_hours"])
+        if args.get("shard"):
+            # every shard keeps its zips, videos and thumbnails in its own directory, so
+            # shards running at the same time never write the same file, and the results
+            # hold absolute paths as shards run from their own working directories
+            self.shard = parse_shard(args["shard"])
+            workdir = os.path.join(
+                os.path.abspath(args.get("shard_dir") or SHARD_DIR), "shard-{}of{}".format(*self.shard))
+            self.manifest = BuildManifest(
+                path=os.path.join(workdir, "build_manifest.json"), zip_dir=os.path.join(workdir, "zips"))
+            self.video_store = VideoStore(directory=os.path.join(workdir, "videos"), get=sess.get)
+            self.thumbnail_store = ThumbnailStore(directory=os.path.join(workdir, "thumbnails"), get=sess.get)
+            self.journal_path = os.path.join(workdir, "journal_{}.jsonl")
+
+    def run(self, args, options):
+        """
+        Build and upload one channel per language given as `lang=en,ar,ht`. The channels
+        are built one after the other in this process, so sim downloads, zips and the
+        HTTP and file caches are shared between them.
+        """
+        languages = [lang.strip() for lang in options.get("lang", CHANNEL_LANGUAGE).split(",") if lang.strip()]
+        # tree-only and shard builds stay local: construct_channel runs without uploadchannel
+        local_only = args.get("tree_only") or args.get("shard")
+        if local_only:
+            self.pre_run(args, options)
+        for language in languages:
+            print("Building channel for language:", language)
+            if local_only:
+                channel = self.construct_channel(**dict(args, **dict(options, lang=language)))
+                if args.get("tree_only"):
+                    path = self.save_tree(channel, language, args.get("tree_json"))
+                    print("Wrote the tree of {} nodes to {}".format(channel.count(), path))
+            else:
+                super(PhETSushiChef, self).run(args, dict(options, lang=language))
+            # only reached once the channel is built (and uploaded), otherwise the next run resumes
+            self.close_journal()
+        if len(languages) > 1:
+            print("Built {} channels from {} unique sims, {} of them downloaded".format(
+                len(languages), len(self.dict_downloaded_paths), self.sim_downloads))
+
     def get_channel(self, **kwargs):
         LANGUAGE = kwargs.get("lang", "en")
         lang_obj = getlang(LANGUAGE)
@@ -169,15 +439,22 @@ class PhETSushiChef(SushiChef):
     def construct_channel(self, **kwargs):
         # channel = self.get_channel(**kwargs)
         channel_info = self.channel_info
-        LANGUAGE = CHANNEL_LANGUAGE
+        LANGUAGE = kwargs.get("lang") or CHANNEL_LANGUAGE
+        self.report = RunReport(LANGUAGE)
+        # the stores, HTTP cache and session are shared by all the languages of a run, but
+        # each language's summaries only count its own work
+        for counts in [self.manifest, cache_stats, sess, self.video_store, self.thumbnail_store]:
+            counts.reset_counts()
 
-        if not LANGUAGE:
-            LANGUAGE = kwargs.get("lang", "en")
+        self.translator = None
         if LANGUAGE != 'en':
-            self.translator = GoogleTranslator(source='auto', target=LANGUAGE)
-            self.lang_en_translator = GoogleTranslator(source=CHANNEL_LANGUAGE, target='en')
+            self.translator = TranslationMemory(
+                target=LANGUAGE, path=self.translation_memory_path, translator_class=self.translator_class)
+            self.lang_en_translator = self.translator_class(source=CHANNEL_LANGUAGE, target='en')
 
-        dict_downloaded_paths = {}
+        # shared by all the languages built in this process, so a runUrl that several
+        # locales fall back to is only downloaded and zipped once
+        dict_downloaded_paths = self.dict_downloaded_paths
         lang_obj = getlang(LANGUAGE)
         if LANGUAGE == 'ht':
             title = channel_info['CHANNEL_TITLE'].get('ht')
@@ -193,7 +470,8 @@ class PhETSushiChef(SushiChef):
         description = channel_info.get('CHANNEL_DESCRIPTION').get(LANGUAGE)
         if not description and self.translator:
             description = channel_info.get('CHANNEL_DESCRIPTION').get("en")
-            description = self.translator.translate(description)
+            with self.report.stage("translation"):
+                description = self.translator.translate(description)
 
         channel = ChannelNode(
             source_domain=channel_info['CHANNEL_SOURCE_DOMAIN'],
@@ -216,26 +494,123 @@ class PhETSushiChef(SushiChef):
         # )
         if LANGUAGE == 'id':
             LANGUAGE = 'in'
-        r_sim = sess.get(f"{BASE_URL}/partner-services/2.0/metadata/simulations?locale=" + LANGUAGE)
-        r_cat = sess.get(f"{BASE_URL}/partner-services/2.0/metadata/categories?locale=" + LANGUAGE)
-        r_keyword = sess.get(f"{BASE_URL}/partner-services/2.0/metadata/keywords?locale=" + LANGUAGE)
-        sim_data = json.loads(r_sim.text)
-        cat_data = json.loads(r_cat.text)
-        keyword_data = json.loads(r_keyword.text)
+        with self.report.stage("metadata"):
+            # the simulations listing is by far the largest response, so it is parsed while
+            # it streams in, keeping only what the build reads for this language
+            r_sim = sess.get(f"{BASE_URL}/partner-services/2.0/metadata/simulations?locale=" + LANGUAGE, stream=True)
+            sims = load_sims(r_sim, LANGUAGE)
+            r_cat = sess.get(f"{BASE_URL}/partner-services/2.0/metadata/categories?locale=" + LANGUAGE)
+            cat_data = json.loads(r_cat.content)
+        self.sim_jobs = []
+        self.sim_records = {}
+        # the records taken from the journal or the shard results rather than built this run
+        self.loaded_records = set()
+        self.sim_details = {}
+        self.sim_detail_requests_saved = 0
+        self.topics = []
+        self.logged_results = set()
+        self.category_index = CategoryIndex(
+            cat_data, ID_BLACKLIST_BY_LANG.get(LANGUAGE, ID_BLACKLIST_BY_LANG['en']))
+        self.selected_categories = self.category_index.select(kwargs.get("only_category"), kwargs.get("only_sim"))
+        self.selected_sims = set(kwargs.get("only_sim") or []) or None
+        self.rebuild_zips = kwargs.get("rebuild_zips", False)
+        self.merging = kwargs.get("merge", False)
+        self.strip_locales = kwargs.get("strip_locales", False)
+        self.rules_hash = STRIPPED_RULES_HASH if self.strip_locales else REWRITE_RULES_HASH
+        self.string_savings = {}
+        if kwargs.get("video_max_mb"):
+            self.video_max_bytes = float(kwargs["video_max_mb"]) * 1024 ** 2
+        if kwargs.get("video_max_kbps"):
+            self.video_max_kbps = float(kwargs["video_max_kbps"])
+        self.tree_only = kwargs.get("tree_only", False)
+        # a missing title mapping would otherwise raise a KeyError deep into the build
+        self.check_category_titles(cat_data, LANGUAGE)
+        self.keep_staging = kwargs.get("keep_staging", False)
         self.download_category(
             parent=channel,
-            cat_id="1",
+            cat_id=self.category_index.root_id,
             categories=cat_data,
-            sims={sim["id"]: sim for sim in sim_data["simulations"]},
-            keywords={keyword_data.get(key).get("id"): keyword_data.get(key)["strings"][LANGUAGE] for key in
-                      keyword_data if keyword_data.get(key)["strings"]},
+            sims=sims,
             language=LANGUAGE,
             dict_downloaded_paths=dict_downloaded_paths
         )
+        shard_dir = os.path.abspath(kwargs.get("shard_dir") or SHARD_DIR)
+        shard_log = None
+        if self.shard:
+            index, count = self.shard
+            self.sim_jobs = [job for job in self.sim_jobs if shard_of(job[2], count) == index]
+            print("Building the {} sims of shard {}/{}".format(len({job[2] for job in self.sim_jobs}), index, count))
+            # the results only get their final name once the whole shard is built
+            shard_log = ResultLog(shard_results_path(shard_dir, LANGUAGE, index, count) + ".partial", mode="w")
+            self.result_logs.append(shard_log)
+        if kwargs.get("merge"):
+            results = read_shard_results(shard_dir, LANGUAGE)
+            # shards built with other rewrite rules or --strip-locales would not match the downloaded keys
+            mismatched = sorted({result["sim_id"] for result in results if result.get("rules_hash") != self.rules_hash})
+            if mismatched:
+                raise ValueError("Shard results in {} for sims {} were built with other rewrite rules "
+                                 "or another --strip-locales setting".format(shard_dir, mismatched))
+            self.load_results(results)
+            missing = sorted({sim_id for topic, sim, sim_id in self.sim_jobs if (sim_id, LANGUAGE) not in self.sim_records})
+            if missing:
+                raise ValueError("No shard results in {} for sims {}".format(shard_dir, missing))
+        elif not self.tree_only:
+            # a rebuild must not reuse the zips of an interrupted run either
+            self.open_journal(LANGUAGE, restart=kwargs.get("restart", False) or self.rebuild_zips)
+        # sims whose results are already known need no detail, translation, video or thumbnail work
+        pending_jobs = [job for job in self.sim_jobs if (job[2], LANGUAGE) not in self.sim_records]
+        prefetch_workers = kwargs.get("prefetch_workers", PREFETCH_MAX_WORKERS)
+        if prefetch_workers:
+            with self.report.stage("prefetch"):
+                self.prefetch_sim_details(pending_jobs, LANGUAGE, int(prefetch_workers))
+        if self.translator:
+            with self.report.stage("translation"):
+                self.prefetch_translations(pending_jobs, LANGUAGE)
+        video_workers = int(kwargs.get("video_workers", 4) or 0)
+        thumbnail_workers = int(kwargs.get("thumbnail_workers", THUMBNAIL_MAX_WORKERS) or 0)
+        if self.tree_only:
+            video_workers = thumbnail_workers = 0
+        if video_workers:
+            with self.report.stage("video"):
+                self.download_videos(pending_jobs, LANGUAGE, video_workers)
+        if thumbnail_workers:
+            with self.report.stage("thumbnail"):
+                self.prefetch_thumbnails(pending_jobs, thumbnail_workers)
+        self.download_sims(
+            self.sim_jobs,
+            LANGUAGE,
+            dict_downloaded_paths,
+            workers=int(kwargs.get("workers") or 1),
+            zip_workers=kwargs.get("zip_workers"),
+        )
+        if thumbnail_workers:
+            with self.report.stage("thumbnail"):
+                self.set_topic_thumbnails(self.topics)
+        if shard_log:
+            self.result_logs.remove(shard_log)
+            shard_log.close()
+            os.replace(shard_log.path, shard_results_path(shard_dir, LANGUAGE, *self.shard))
+            print("Wrote the results of {} sims to {}".format(
+                len(self.logged_results), shard_results_path(shard_dir, LANGUAGE, *self.shard)))
+        print("Fetched details for {} sims, {} requests saved on repeated sims".format(
+            len(self.sim_records) - len(self.loaded_records), self.sim_detail_requests_saved))
+        if self.loaded_records:
+            print("Took the records of {} sims from earlier results".format(len(self.loaded_records)))
+        self.manifest.save()
+        self.manifest.print_summary()
+        if self.strip_locales:
+            self.print_string_savings()
+        if self.translator:
+            self.translator.save()
+            self.translator.print_summary()
+        cache_stats.print_summary(cache)
+        sess.print_summary()
+        self.report.save(self.report_path.format(LANGUAGE))
+        self.report.print_summary()
 
         return channel
 
-    def download_category(self, parent, cat_id, categories, sims, keywords, language, dict_downloaded_paths):
+    def download_category(self, parent, cat_id, categories, sims, language, dict_downloaded_paths):
         """
         Process a category, and add all its sub-categories, and its simulations/videos.
         """
@@ -247,31 +622,18 @@ class PhETSushiChef(SushiChef):
             cat_name = dict_cat_name.get('en')
         elif dict_cat_name.get(CHANNEL_LANGUAGE):
             cat_name = dict_cat_name.get(CHANNEL_LANGUAGE)
-        # loop through all subtopics and recursively add them
-        # (reverse order seems to give most rational results)
-        for child_id in reversed(cat["childrenIds"]):
+        # loop through all subtopics (the index has already dropped blacklisted ones)
+        # and recursively add them (reverse order seems to give most rational results)
+        for child_id in reversed(self.category_index.children[cat_id]):
+            # skip it if it's outside the --only-category/--only-sim selection
+            if self.selected_categories is not None and child_id not in self.selected_categories:
+                continue
             metadata = {}
             if METADATA_BY_CAT.get(child_id):
                 metadata = METADATA_BY_CAT.get(child_id)
             # look up the child category by ID
             subcat = categories[str(child_id)]
-            # skip it if it's in our blacklist
-            if subcat["name"] in ID_BLACKLIST_BY_LANG.get(language, ID_BLACKLIST_BY_LANG['en']):
-                continue
-            # make the title human-readable, and clean it up
-
-            title = subcat['strings'].get(language)
-            if not title:
-                title = subcat["name"].replace("-", " ").title()
-                title = title.replace(" And ", " and ")
-                title = title.replace("Mathconcepts", "Concepts")
-                title = title.replace("Mathapplications", "Applications")
-            if language == 'en':
-                pass
-            elif language == "ar":
-                title = ARABIC_NAME_CATEGORY[title]
-            elif language == 'ht':
-                title = HAITIAN_NAME_CATEGORY[title]
+            title = get_category_title(subcat, language)
             if metadata:
                 subtopic = TopicNode(
                     source_id=subcat["name"],
@@ -286,152 +648,501 @@ class PhETSushiChef(SushiChef):
                     derive_thumbnail=True
                 )
             parent.add_child(subtopic)
+            self.topics.append(subtopic)
             # recursively download the contents of the topic
-            self.download_category(subtopic, child_id, categories, sims, keywords, language, dict_downloaded_paths)
+            self.download_category(subtopic, child_id, categories, sims, language, dict_downloaded_paths)
 
-        # loop through all sims in this topic and add them, but only if we're at a leaf topic
-        if len(parent.children) == 0:
+        # queue all sims in this topic for download, but only if we're at a leaf topic
+        if cat_id in self.category_index.leaves:
             for sim_id in list(set(cat["simulationIds"])):
                 # skip ones that aren't found (probably as they aren't HTML5)
                 if sim_id not in sims:
                     continue
-                self.download_sim(parent, sims[sim_id], sim_id, keywords, language, dict_downloaded_paths)
-
-    def download_sim(self, topic, sim, sim_id, keywords, language, dict_downloaded_paths):
-        """
-        Download, zip, and add a node for a sim, as well as any associated video.
-        """
-        sim_detail_res = sess.get(
-            f'https://phet-api.colorado.edu/partner-services/2.0/metadata/simulations/{sim_id}?locale={language}')
-        sim_detail_data = json.loads(sim_detail_res.text)
-        description = None
-        run_url = sim.get('defaultData').get('runUrl')
-        title = sim.get('defaultData').get('title')
-        description = sim.get('defaultData').get('description')
-        if sim.get('localizedData') and sim.get('localizedData').get(language):
-            if sim.get('localizedData').get(language).get('runUrl'):
-                run_url = sim.get('localizedData').get(language).get('runUrl')
-            if sim.get('localizedData').get(language).get('title'):
-                title = sim.get('localizedData').get(language).get('title')
-            if sim.get('localizedData').get(language).get('description'):
-                description = sim.get('localizedData').get(language).get('description')
+                if self.selected_sims is not None and sim_id not in self.selected_sims:
+                    continue
+                self.sim_jobs.append((parent, sims[sim_id], sim_id))
 
-        else:
-            if self.translator:
-                title = self.translator.translate(text=title)
-            if description:
-                description = self.translator.translate(text=description)
+    def check_category_titles(self, categories, language):
+        """
+        Raise a KeyError listing every category to be built whose title has no entry in the
+        language's title mapping, before any sim is downloaded.
+        """
+        missing = []
+        for cat_id in self.category_index.children:
+            if cat_id == self.category_index.root_id:
+                continue
+            if self.selected_categories is not None and cat_id not in self.selected_categories:
+                continue
+            try:
+                get_category_title(categories[str(cat_id)], language)
+            except KeyError as e:
+                missing.append("{} ({})".format(e.args[0], cat_id))
+        if missing:
+            raise KeyError("No {} title for categories: {}".format(language, ", ".join(sorted(missing))))
 
-        download_url = f'{BASE_URL_DOWNLOAD}{run_url}?download'
-        print("\tProcessing sim:", title)
-        dst = None
-        if download_url not in dict_downloaded_paths:
-            dst = tempfile.mkdtemp()
-            dict_downloaded_paths[download_url] = {"dst": dst}
-        if dst:
-            download_file(
-                download_url,
-                dst,
-                filename="index.html",
-                request_fn=sess.get,
-                middleware_callbacks=[process_sim_html],
-                middleware_kwargs={ "sim_title": title },
-            )
+    def save_tree(self, channel, language, path=None):
+        """
+        Write the topic/sim tree built by --tree-only as JSON and return its path.
+        """
+        path = path or TREE_JSON_PATH.format(language)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(node_to_dict(channel), f, indent=1, ensure_ascii=False)
+        return path
+
+    def load_results(self, results):
+        """
+        Take the records, zips, videos and thumbnails of sims built elsewhere (see
+        `sim_results`), so `download_sim` only has to create their nodes.
+        """
+        for result in results:
+            record = result["record"]
+            self.sim_records[(result["sim_id"], result["language"])] = record
+            self.loaded_records.add((result["sim_id"], result["language"]))
+            self.dict_downloaded_paths[self.downloaded_key(result["download_url"], result["language"])] = {
+                "zippath": result["zippath"], "html_hash": result["html_hash"]}
+            if result.get("video_path"):
+                self.video_paths[record["video_url"]] = result["video_path"]
+            if record["thumbnail"] and os.path.exists(record["thumbnail"]):
+                # already a local file, which is all set_topic_thumbnails looks at
+                self.thumbnail_paths[record["thumbnail"]] = record["thumbnail"]
+
+    def open_journal(self, language, restart=False):
+        """
+        Replay the journal left by an interrupted build of `language`, so the sims it finished
+        need no network or CPU work, and append every sim built from now on to it.
+        """
+        path = self.journal_path.format(language)
+        results = []
+        if os.path.exists(path) and not restart:
+            results = [result for result in ResultLog.read(path) if self.can_resume(result)]
+            print("Resuming from {}: {} sims already built".format(path, len({r["sim_id"] for r in results})))
+        self.load_results(results)
+        self.journaled = {(result["sim_id"], result["language"]) for result in results}
+        self.journal = ResultLog(path, mode="w" if restart else "a", fsync=True)
+        self.result_logs.append(self.journal)
+
+    def can_resume(self, result):
+        # the zip must have been built with the current rewrite rules and survived the crash
+        return (result.get("rules_hash") == self.rules_hash
+                and zipfile.is_zipfile(result["zippath"])
+                and (not result.get("video_path") or os.path.exists(result["video_path"])))
+
+    def close_journal(self):
+        """
+        Remove the journal once the channel it belongs to has been built.
+        """
+        if not self.journal:
+            return
+        self.result_logs.remove(self.journal)
+        self.journal.close()
+        os.remove(self.journal.path)
+        self.journal = None
+        self.journaled = set()
+
+    def log_result(self, sim_id, language, download_url, record):
+        """
+        Append the result of a built sim to the result logs, once per sim and language.
+        """
+        if not self.result_logs:
+            return
+        with self.download_lock:
+            if (sim_id, language) in self.logged_results:
+                return
+            self.logged_results.add((sim_id, language))
+        downloaded = self.dict_downloaded_paths[self.downloaded_key(download_url, language)]
+        result = make_result(sim_id, language, download_url, downloaded["zippath"], downloaded["html_hash"],
+                             record, self.video_paths.get(record["video_url"]), self.rules_hash)
+        for result_log in self.result_logs:
+            # sims replayed from the journal are already in it
+            if result_log is self.journal and (sim_id, language) in self.journaled:
+                continue
+            result_log.append(result)
 
-            zippath = create_predictable_zip(dst)
-            dict_downloaded_paths.get(download_url).update({"zippath": zippath})
-
-        authors = None
-        if sim_detail_data.get("thanksTo"):
-            authors = re.sub(" \(.*?\)", "", sim_detail_data["thanksTo"])
-            authors = re.sub("<br\/?>", ", ", authors)
-
-        if language == "ar":
-            if title in ARABIC_NAME_CATEGORY:
-                title = ARABIC_NAME_CATEGORY[title]
-            if title in SIM_TYPO:
-                title = SIM_TYPO[title]
-        elif language == 'ht':
-            if title in HAITIAN_NAME_CATEGORY:
-                title = HAITIAN_NAME_CATEGORY[title]
+    def get_sim_detail_url(self, sim_id, language):
+        return f'{BASE_URL}/partner-services/2.0/metadata/simulations/{sim_id}?locale={language}'
+
+    def prefetch_sim_details(self, jobs, language, max_workers):
+        """
+        Fetch the detail metadata of every queued sim concurrently before any sim is
+        processed, so `get_sim_record` works from memory.
+        """
+        urls = {}
+        for topic, sim, sim_id in jobs:
+            if (sim_id, language) not in self.sim_details:
+                urls.setdefault(self.get_sim_detail_url(sim_id, language), sim_id)
+
+        def get(url):
+            with self.report.stage("sim-detail", sim=urls[url]):
+                return sess.get(url)
+
+        details = prefetch_json(list(urls), get, max_workers=max_workers)
+        for url, sim_detail_data in details.items():
+            self.sim_details[(urls[url], language)] = sim_detail_data
+
+    def get_video_url(self, sim_detail_data):
+        """
+        Return the link of the primer video rendition to publish for a sim, or None.
+        """
+        default_data = sim_detail_data.get('defaultData') or {}
+        if not default_data.get('simPrimerVimeoData'):
+            return None
+        return select_rendition(
+            default_data['simPrimerVimeoData'], max_bytes=self.video_max_bytes, max_kbps=self.video_max_kbps)
+
+    def download_videos(self, jobs, language, max_workers):
+        """
+        Download the primer videos of all the sims of `jobs` into the local video store, each
+        URL once however many sims and topics share it.
+        """
+        missing = [job for job in jobs if (job[2], language) not in self.sim_details]
+        if missing:
+            # the details hold the video links; without --prefetch-workers they have not been
+            # fetched yet, so fetch them now (get_sim_record then uses them)
+            self.prefetch_sim_details(missing, language, PREFETCH_MAX_WORKERS)
+        urls = []
+        for topic, sim, sim_id in jobs:
+            sim_detail_data = self.sim_details.get((sim_id, language))
+            video_url = self.get_video_url(sim_detail_data) if sim_detail_data else None
+            if video_url and video_url not in self.video_paths:
+                urls.append(video_url)
+        self.video_paths.update(self.video_store.download_all(urls, max_workers=max_workers))
+        self.video_store.print_summary(len(self.video_paths))
+
+    def prefetch_thumbnails(self, jobs, max_workers):
+        """
+        Fetch the thumbnails of all queued sims into the local thumbnail store, each URL once.
+        """
+        urls = [sim.image_url for topic, sim, sim_id in jobs if sim.image_url]
+        self.thumbnail_paths.update(self.thumbnail_store.fetch_all(urls, max_workers=max_workers))
+
+    def set_topic_thumbnails(self, topics):
+        """
+        Give each topic a thumbnail tiled from the locally stored thumbnails of its sims, so
+        ricecooker does not have to derive it from their images at upload time.
+        """
+        stored = set(self.thumbnail_paths.values())
+        for topic in topics:
+            paths = [node.thumbnail.path for node in topic.get_non_topic_descendants()
+                     if node.thumbnail and node.thumbnail.path in stored]
+            path = self.thumbnail_store.tiled(paths)
+            if path:
+                topic.set_thumbnail(path)
+                topic.derive_thumbnail = False
+        self.thumbnail_store.print_summary(len(stored))
+
+    def prefetch_translations(self, jobs, language):
+        """
+        Send every title and description that `get_sim_record` will translate through the
+        translation memory in batches, so the per-sim lookups need no network calls.
+        """
+        sims = {sim_id: sim for topic, sim, sim_id in jobs}
+        texts = []
+        titles = []
+        for sim in sims.values():
+            if sim.localized:
+                titles.append(sim.title)
+            else:
+                texts.append(sim.title)
+                texts.append(sim.description)
+        translated = self.translator.translate_batch(texts)
+        # titles of untranslated sims are translated a second time for languages other
+        # than ar and ht (see get_sim_record), so queue their first translation too
+        if language not in ("ar", "ht"):
+            self.translator.translate_batch(titles + translated[::2])
+
+    def download_sims(self, jobs, language, dict_downloaded_paths, workers=1, zip_workers=None):
+        """
+        Run the download and rewrite stages for every queued (topic, sim) pair on a pool
+        of `workers` threads, then add the resulting nodes to their topics in crawl order.
+        Zips are compressed on a separate process pool while the downloads continue.
+        """
+        def process(job):
+            topic, sim, sim_id = job
+            return self.download_sim(topic, sim, sim_id, language, dict_downloaded_paths)
+
+        self.zip_futures = []
+        with ProcessPoolExecutor(max_workers=zip_workers) as self.packager:
+            if workers > 1:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    results = list(executor.map(process, jobs))
+            else:
+                results = [process(job) for job in jobs]
+            wait(self.zip_futures)
+        for future in self.zip_futures:
+            future.result()
+
+        for (topic, sim, sim_id), nodes in zip(jobs, results):
+            for node in nodes:
+                topic.add_child(node)
+
+    def lock_for(self, key):
+        """
+        Return the lock that serializes work on `key` (a download URL or sim record key)
+        across the worker threads.
+        """
+        with self.download_lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def get_sim_record(self, sim, sim_id, language):
+        """
+        Return the sim's resolved run URL, title, description, authors, thumbnail and video
+        URL. A sim appears under many topics, so each (sim_id, language) is only fetched and
+        translated once per run.
+        """
+        key = (sim_id, language)
+        with self.lock_for(key):
+            if key in self.sim_records:
+                if key not in self.loaded_records:
+                    with self.download_lock:
+                        self.sim_detail_requests_saved += 1
+                return self.sim_records[key]
+
+            # the prefetched details are only needed until the record is built
+            sim_detail_data = self.sim_details.pop(key, None)
+            if sim_detail_data is None:
+                with self.report.stage("sim-detail", sim=sim_id):
+                    sim_detail_res = sess.get(self.get_sim_detail_url(sim_id, language))
+                    sim_detail_data = json.loads(sim_detail_res.content)
+            # the catalog record already has the localized runUrl, title and description
+            run_url = sim.run_url
+            title = sim.title
+            description = sim.description
+            if not sim.localized:
+                with self.report.stage("translation", sim=sim_id):
+                    if self.translator:
+                        title = self.translator.translate(text=title)
+                    if description:
+                        description = self.translator.translate(text=description)
+
+            authors = None
+            if sim_detail_data.get("thanksTo"):
+                authors = re.sub(" \(.*?\)", "", sim_detail_data["thanksTo"])
+                authors = re.sub("<br\/?>", ", ", authors)
+
+            if language == "ar":
+                if title in ARABIC_NAME_CATEGORY:
+                    title = ARABIC_NAME_CATEGORY[title]
+                if title in SIM_TYPO:
+                    title = SIM_TYPO[title]
+            elif language == 'ht':
+                if title in HAITIAN_NAME_CATEGORY:
+                    title = HAITIAN_NAME_CATEGORY[title]
+            else:
+                if self.translator:
+                    with self.report.stage("translation", sim=sim_id):
+                        title = self.translator.translate(text=title)
+            # get thumbnail image, from the local store if prefetch_thumbnails got it
+            sim_image = self.thumbnail_paths.get(sim.image_url, sim.image_url)
+
+            video_url = self.get_video_url(sim_detail_data)
+
+            record = {
+                "run_url": run_url,
+                "title": title,
+                "description": description,
+                "authors": authors,
+                "thumbnail": sim_image,
+                "video_url": video_url,
+            }
+            self.sim_records[key] = record
+            return record
+
+    def download_sim(self, topic, sim, sim_id, language, dict_downloaded_paths):
+        """
+        Download and zip a sim, and return the nodes for it and any associated video.
+        """
+        record = self.get_sim_record(sim, sim_id, language)
+        if self.tree_only:
+            return self.create_sim_nodes(sim, record, None, language)
+        title = record["title"]
+        download_url = f'{BASE_URL_DOWNLOAD}{record["run_url"]}?download'
+        print("\tProcessing sim:", title)
+        # the same sim can be queued under several topics, so only the first worker to
+        # reach a download_url fetches it and the others wait for its zip
+        with self.lock_for(download_url):
+            downloaded = dict_downloaded_paths.setdefault(self.downloaded_key(download_url, language), {})
+            if "zippath" not in downloaded and not self.rebuild_zips:
+                # sims rarely change, so reuse the zip of the previous build when neither
+                # the runUrl nor the rewrite rules have changed since
+                entry = self.manifest.get_entry(sim_id, language, record["run_url"], self.rules_hash)
+                if entry:
+                    downloaded.update({"zippath": entry["zippath"], "html_hash": entry["html_hash"]})
+            if "zippath" not in downloaded:
+                with self.report.stage("html-download", sim=sim_id):
+                    # sim HTML is cached forever, so a rebuild has to ask for it again
+                    headers = {"Cache-Control": "no-cache"} if self.rebuild_zips else None
+                    response = sess.get(download_url, headers=headers)
+                    response.raise_for_status()
+                    if not getattr(response, "from_cache", False):
+                        with self.download_lock:
+                            self.sim_downloads += 1
+                    content = response.text
+                    del response
+                with self.report.stage("process_sim_html", sim=sim_id):
+                    html = process_sim_html(content, None, sim_title=title)
+                    del content
+                if self.strip_locales:
+                    with self.report.stage("strip_locales", sim=sim_id):
+                        html = self.strip_sim_locales(html, sim_id, title, language)
+                html = html.encode("utf-8")
+                downloaded["html_hash"] = hashlib.sha256(html).hexdigest()
+                if self.keep_staging:
+                    dst = tempfile.mkdtemp(prefix="phet-sim-")
+                    with open(os.path.join(dst, "index.html"), "wb") as f:
+                        f.write(html)
+                    downloaded["dst"] = dst
+                    print("\t\tStaged sim HTML in", dst)
+                # the zip path is known up front, so the node can be created while the
+                # packaging pool is still compressing it
+                zippath = self.manifest.new_zip_path(record["run_url"], language)
+                future = self.packager.submit(write_sim_zip, html, zippath)
+                future.add_done_callback(
+                    lambda f: f.exception() or self.report.add_time("zip", f.result(), sim=sim_id))
+                self.zip_futures.append(future)
+                downloaded["zippath"] = zippath
+                downloaded["future"] = future
+        if not self.merging:
+            # the zips of a merge stay in the shard directory, which may be cleaned up later
+            self.manifest.record(
+                sim_id, language, record["run_url"], self.rules_hash, downloaded["html_hash"], downloaded["zippath"])
+        # a sim only counts as built once its zip is written
+        if downloaded.get("future"):
+            downloaded["future"].add_done_callback(
+                lambda f: f.exception() or self.log_result(sim_id, language, download_url, record))
         else:
-            if self.translator:
-                title = self.translator.translate(text=title)
-        # get thumbnail image
-        lst_sim_images = sim.get('defaultData').get('simImages')
-        sim_image = lst_sim_images[0].get('url')
-        for dict_image in lst_sim_images:
-            if dict_image.get('width') == 128:
-                sim_image = dict_image.get('url')
-                break
+            self.log_result(sim_id, language, download_url, record)
+
+        with self.report.stage("nodes", sim=sim_id):
+            return self.create_sim_nodes(sim, record, downloaded["zippath"], language)
 
+    def downloaded_key(self, download_url, language):
+        # sims with stripped strings differ per language even when they share a runUrl
+        return (download_url, language) if self.strip_locales else download_url
+
+    def strip_sim_locales(self, html, sim_id, title, language):
+        """
+        Return the sim's processed HTML without the strings of the locales the channel does not
+        show, recording the bytes saved; the HTML is kept whole if pruning fails its checks.
+        """
+        pruned, removed, problem = prune_string_bundles(html, language)
+        if problem:
+            print("\t\tKept the strings of all locales in {}: {}".format(title, problem))
+            return html
+        size = len(html.encode("utf-8"))
+        saved = size - len(pruned.encode("utf-8")) if removed else 0
+        with self.download_lock:
+            self.string_savings[sim_id] = (size, saved)
+        if removed:
+            print("\t\tRemoved the strings of {} locales from {}, {:.1f} of {:.1f} KB".format(
+                len(removed), title, saved / 1024, size / 1024))
+        return pruned
+
+    def print_string_savings(self):
+        sizes = sum(size for size, saved in self.string_savings.values())
+        saved = sum(saved for size, saved in self.string_savings.values())
+        print("Locale stripping saved {:.1f} of {:.1f} MB of sim HTML over {} sims".format(
+            saved / 1024 ** 2, sizes / 1024 ** 2, len(self.string_savings)))
+
+    def create_sim_nodes(self, sim, record, zippath, language):
+        """
+        Return the nodes for a downloaded sim: its video (if any) followed by the sim itself.
+        """
+        title = record["title"]
         # create a node for the sim
-        zippath = dict_downloaded_paths.get(download_url).get('zippath')
         simnode = HTML5AppNode(
-            source_id="sim-%d" % sim["id"],
-            files=[HTMLZipFile(zippath)],
+            source_id="sim-%d" % sim.id,
+            files=[HTMLZipFile(zippath)] if zippath else [],
             title=title,
-            description=description,
+            description=record["description"],
             license=CC_BYLicense("PhET Interactive Simulations, University of Colorado Boulder"),
-            author=authors,
+            author=record["authors"],
             # tags=[keywords[topic] for topic in sim["topicIds"]],
-            thumbnail=sim_image,
+            thumbnail=record["thumbnail"],
             language=getlang(language),
-            derive_thumbnail=True
+            # only derive a thumbnail from the sim if it has no image of its own
+            derive_thumbnail=not record["thumbnail"]
 
         )
 
         # if there's a video, extract it and put it in the topic right before the sim
-        if sim_detail_data.get('defaultData') and sim_detail_data.get('defaultData').get('simPrimerVimeoData'):
-            videos = sim_detail_data["defaultData"]["simPrimerVimeoData"]['files']
-            if videos:
-                video_url = [v for v in videos if v.get("height") == 540][0]["link"]
-
-                videonode = VideoNode(
-                    source_id="video-%d" % sim["id"],
-                    files=[VideoFile(video_url)],
-                    title="Video: %s" % title,
-                    license=CC_BYLicense("PhET Interactive Simulations, University of Colorado Boulder"),
-                    thumbnail=sim_image,
-                    role=roles.COACH,
-                    derive_thumbnail=True
-                )
+        nodes = []
+        if record["video_url"]:
+            videonode = VideoNode(
+                source_id="video-%d" % sim.id,
+                # the local copy from download_videos, or the Vimeo link for ricecooker to fetch
+                files=[VideoFile(self.video_paths.get(record["video_url"], record["video_url"]))],
+                title="Video: %s" % title,
+                license=CC_BYLicense("PhET Interactive Simulations, University of Colorado Boulder"),
+                thumbnail=record["thumbnail"],
+                role=roles.COACH,
+                derive_thumbnail=not record["thumbnail"]
+            )
 
-                topic.add_child(videonode)
+            nodes.append(videonode)
 
-        # add the sim node into the topic
-        topic.add_child(simnode)
+        nodes.append(simnode)
+        return nodes
 
 
-def process_sim_html(content, destpath, **kwargs):
-    """Remove various pieces of the code that make requests to online resources, to avoid using
-    bandwidth for users expecting a fully offline or zero-rated website."""
+def get_category_title(cat, language):
+    """
+    Return the topic title of a category in `language`, raising a KeyError if the language
+    maps titles and has no entry for it.
+    """
+    # make the title human-readable, and clean it up
+    title = cat['strings'].get(language)
+    if not title:
+        title = cat["name"].replace("-", " ").title()
+        title = title.replace(" And ", " and ")
+        title = title.replace("Mathconcepts", "Concepts")
+        title = title.replace("Mathapplications", "Applications")
+    if language == 'en':
+        pass
+    elif language == "ar":
+        title = ARABIC_NAME_CATEGORY[title]
+    elif language == 'ht':
+        title = HAITIAN_NAME_CATEGORY[title]
+    return title
 
-    # remove "are we online" check
-    content = content.replace("check:function(){var t=this", "check:function(){return;var t=this")
 
-    # remove online links from "about" modal
-    content = content.replace("getLinks:function(", "getLinks:function(){return [];},doNothing:function(")
+def node_to_dict(node):
+    """
+    Return the fields of a node checked in a --tree-only run, with those of its children.
+    """
+    data = {
+        "kind": node.kind,
+        "source_id": node.source_id,
+        "title": node.title,
+    }
+    for field in ["grade_levels", "categories"]:
+        if getattr(node, field, None):
+            data[field] = getattr(node, field)
+    if node.children:
+        data["children"] = [node_to_dict(child) for child in node.children]
+    return data
+
 
-    # setting up the query parameters for cases in which it works
-    regex = r"(this\.getAllForString\([^,]+,[^w]*)(window\.location\.search)(\s*\))"
-    replacement = r"\1window.location.search === '' ? '?allowLinks=false&disableFullscreen' : window.location.search\3"
-    content = re.sub(regex, replacement, content)
-    soup = BeautifulSoup(content, "html.parser")
+def write_sim_zip(html, zippath):
+    """
+    Write the processed sim HTML as the only entry (index.html) of a predictable zip at
+    `zippath`, byte for byte what `create_predictable_zip` produces for a directory holding
+    just that file. Runs in the packaging process pool, so the HTML never touches disk.
+    Returns the seconds spent compressing.
+    """
+    start = time.perf_counter()
+    tmp_path = zippath + ".tmp"
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as outputzip:
+        write_file_to_zip_with_neutral_metadata(outputzip, "index.html", html)
+    os.replace(tmp_path, zippath)
+    return time.perf_counter() - start
 
 
-    for script in soup.find_all("script"):
-        # remove Google Analytics and online image bug requests
-        if "analytics.js" in str(script):
-            script.extract()
+def process_sim_html(content, destpath, **kwargs):
+    """Remove various pieces of the code that make requests to online resources, to avoid using
+    bandwidth for users expecting a fully offline or zero-rated website."""
 
-        if 'phetWebsite' in str(script):
-            # remove menu options that link to online resources
-            # fallbacks in case the above regex work fails
-            script.string = re.compile('tandem: e.createTandem\(\"screenshotMenuItem\"\),').sub("", script.string)
-            script.string = re.compile('tandem: e.createTandem\(\"fullScreenMenuItem\"\),').sub("", script.string)
-            script.string = re.compile('string!JOIST/menuItem.reportAProblem').sub("", script.string)
-            script.string = re.compile('string!JOIST/menuItem.phetWebsite').sub("", script.string)
+    content = rewrite_sim_html(content)
 
     clean_title = kwargs.get("sim_title").replace(" ", "-").replace("'", "-")
 
@@ -452,9 +1163,22 @@ def process_sim_html(content, destpath, **kwargs):
         # Write's every sim's HTML to the directory
         # in a terminal, run: python -m http.server <port> to test sims in your browser
         with open("processed_sims/{}.html".format(clean_title), 'w') as f:
-            f.write(str(soup))
+            f.write(content)
             f.close()
-    return str(soup)
+    return content
+
+
+# hash of the rewrite rules, so the build manifest can tell when zips built by an
+# earlier version of the rules have to be rebuilt
+REWRITE_RULES_HASH = hashlib.sha256("\n".join(
+    [pattern.pattern + replacement for pattern, replacement in DOCUMENT_REWRITES]
+    + [pattern.pattern for pattern in PHET_WEBSITE_REMOVALS]
+    + [inspect.getsource(inspect.getmodule(rewrite_sim_html))]
+).encode("utf-8")).hexdigest()
+# zips with --strip-locales depend on the string pruning as well
+STRIPPED_RULES_HASH = hashlib.sha256("\n".join(
+    [REWRITE_RULES_HASH, inspect.getsource(inspect.getmodule(prune_string_bundles))]
+).encode("utf-8")).hexdigest()
 
 
 if __name__ == '__main__':
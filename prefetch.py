@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Concurrent prefetch of JSON endpoints with adaptive rate limiting.
+
+The number of requests in flight grows by one after every few successful
+responses and is halved as soon as the server answers 429 or 5xx (pausing for
+its Retry-After if it sends one), so the chef goes as fast as the PhET API
+allows without hammering it when it struggles.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PREFETCH_MAX_WORKERS = 16
+PREFETCH_ATTEMPTS = 5
+
+
+def is_throttled(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+class AdaptiveLimiter(object):
+    """
+    Additive-increase/multiplicative-decrease limit on the number of concurrent requests.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=PREFETCH_MAX_WORKERS, increase_every=5):
+        self.limit = min(initial, maximum)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase_every = increase_every
+        self.active = 0
+        self.successes = 0
+        self.backoffs = 0
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= self.limit or time.time() < self.paused_until:
+                self.condition.wait(timeout=max(0.05, self.paused_until - time.time()))
+            self.active += 1
+
+    def release(self, status_code, retry_after=None):
+        with self.condition:
+            self.active -= 1
+            if is_throttled(status_code):
+                self.limit = max(self.minimum, self.limit // 2)
+                self.successes = 0
+                self.backoffs += 1
+                self.paused_until = max(self.paused_until, time.time() + (retry_after or 1.0))
+            else:
+                self.successes += 1
+                if self.successes >= self.increase_every and self.limit < self.maximum:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+
+def parse_retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def prefetch_json(urls, get, max_workers=PREFETCH_MAX_WORKERS, limiter=None):
+    """
+    GET every URL in `urls` with `get` (e.g. a session's get method) on up to `max_workers`
+    threads, gated by an `AdaptiveLimiter`, and return {url: decoded JSON}. Throttled
+    responses are retried up to `PREFETCH_ATTEMPTS` times; URLs that still fail are left
+    out, so the caller can fall back to fetching them itself.
+    """
+    limiter = limiter or AdaptiveLimiter(maximum=max_workers)
+
+    def fetch(url):
+        for attempt in range(PREFETCH_ATTEMPTS):
+            limiter.acquire()
+            status_code = 599
+            response = None
+            try:
+                response = get(url)
+                status_code = response.status_code
+            except Exception as e:
+                print("\tPrefetch of {} failed: {}".format(url, e))
+            finally:
+                limiter.release(status_code, parse_retry_after(response) if response is not None else None)
+            if response is not None and not is_throttled(status_code):
+                if response.ok:
+                    return json.loads(response.content)
+                return None
+        return None
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for url, data in zip(urls, executor.map(fetch, urls)):
+            if data is not None:
+                results[url] = data
+    print("Prefetched {} of {} URLs (concurrency limit {}, backed off {} times)".format(
+        len(results), len(urls), limiter.limit, limiter.backoffs))
+    return results
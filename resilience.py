@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Timeouts, hedged requests and a circuit breaker for the chef's shared session.
+
+`ResilientSession` gives every request the connect/read timeout of its
+endpoint from `get_timeouts`, so a stalled connection fails instead of hanging
+the run. GETs to slow endpoints can be hedged: if the first request has not
+answered after a delay, a duplicate is sent and whichever answers first is
+used. A `CircuitBreaker` per host counts consecutive failed attempts, which
+`CountingRetry` reports from inside the adapter's retry loop, and, once the
+host is clearly down, stops retrying and either pauses all requests to it for
+a cool-down or fails them at once, instead of spending the full retry backoff
+on every remaining sim.
+"""
+
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+from requests.packages.urllib3.exceptions import ReadTimeoutError
+from requests.packages.urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = (10, 60)
+BREAKER_THRESHOLD = 10
+BREAKER_COOLDOWN = 30
+
+
+def get_timeouts(api_url, download_url):
+    """
+    Return the (url prefix, (connect timeout, read timeout)) rules for the PhET endpoints.
+    """
+    return [
+        (f'{api_url}/partner-services/2.0/metadata/', (5, 30)),
+        (f'{download_url}/sims/html/', (10, 120)),
+    ]
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised for requests to a host whose circuit breaker is open in 'fail' mode.
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Opens after `threshold` consecutive failed attempts (connection errors, timeouts and
+    5xx responses, counting every retry) on a host. While open, requests to the host wait for the `cooldown` to end
+    in 'pause' mode, or raise `CircuitOpenError` in 'fail' mode. The first failure after
+    a cool-down opens it again; a success closes it.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN, mode='pause'):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.open_until = {}
+        self.trips = 0
+
+    def before_request(self, host):
+        with self.lock:
+            open_until = self.open_until.get(host, 0)
+        wait_seconds = open_until - time.time()
+        if wait_seconds <= 0:
+            return
+        if self.mode == 'fail':
+            raise CircuitOpenError("{} is down: {} requests in a row failed".format(host, self.threshold))
+        print("\t{} is down, pausing requests to it for {:.0f}s".format(host, wait_seconds))
+        time.sleep(wait_seconds)
+
+    def is_open(self, host):
+        with self.lock:
+            return self.open_until.get(host, 0) > time.time()
+
+    def record(self, host, ok):
+        with self.lock:
+            if ok:
+                self.failures[host] = 0
+                return
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if self.failures[host] >= self.threshold and self.open_until.get(host, 0) <= time.time():
+                self.open_until[host] = time.time() + self.cooldown
+                # a single failure after the cool-down is enough to open it again
+                self.failures[host] = self.threshold - 1
+                self.trips += 1
+
+
+class CountingRetry(Retry):
+    """
+    A `Retry` that reports every failed attempt and every retry to `session`, and stops
+    retrying a host as soon as the session's circuit breaker opens for it.
+    """
+
+    def __init__(self, *args, session=None, **kwargs):
+        super(CountingRetry, self).__init__(*args, **kwargs)
+        self.session = session
+
+    def new(self, **kwargs):
+        retry = super(CountingRetry, self).new(**kwargs)
+        retry.session = self.session
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if self.session is None:
+            return super(CountingRetry, self).increment(method, url, response, error, _pool, _stacktrace)
+        host = _pool.host if _pool is not None else urlsplit(url).hostname
+        retry = self
+        if error is not None or (response is not None and response.status >= 500):
+            self.session.breaker.record(host, ok=False)
+            if self.session.breaker.is_open(host):
+                # the next attempt would only add to the backoff: raise the MaxRetryError now
+                retry = self.new(total=0)
+        # raises once the retries are exhausted, so only retries that will be sent are counted
+        retry = super(CountingRetry, retry).increment(method, url, response, error, _pool, _stacktrace)
+        self.session.count('retries')
+        return retry
+
+
+class ResilientSession(requests.Session):
+    """
+    A session that adds the timeouts, hedging and circuit breaker. Mount its adapters with
+    `retry(...)` so the breaker sees every failed attempt rather than every failed request.
+    """
+
+    def __init__(self, timeouts=(), breaker=None, hedge_prefixes=(), hedge_delay=None):
+        super(ResilientSession, self).__init__()
+        self.timeouts = sorted(timeouts, key=lambda rule: -len(rule[0]))
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge_prefixes = list(hedge_prefixes)
+        self.hedge_delay = hedge_delay
+        self.hedge_executor = None
+        self.hedge_workers = 0
+        self.hedge_callers = 0
+        # the callers holding each hedge executor, so a replaced one is shut down once they are done
+        self.hedge_users = {}
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'timeouts': 0, 'errors': 0, 'hedged': 0, 'hedges_won': 0}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def reset_counts(self):
+        with self.lock:
+            self.stats = dict.fromkeys(self.stats, 0)
+        self.breaker.trips = 0
+
+    def retry(self, **kwargs):
+        """
+        Return a `CountingRetry` with the `Retry` arguments `kwargs` that reports to this session.
+        """
+        return CountingRetry(session=self, **kwargs)
+
+    def timeout_for(self, url):
+        for prefix, timeout in self.timeouts:
+            if url.startswith(prefix):
+                return timeout
+        return DEFAULT_TIMEOUT
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout_for(url)
+        host = urlsplit(url).hostname
+        self.breaker.before_request(host)
+        hedge = (self.hedge_delay is not None and method.upper() == 'GET'
+                 and any(url.startswith(prefix) for prefix in self.hedge_prefixes))
+        try:
+            if hedge:
+                response = self.hedged_request(method, url, **kwargs)
+            else:
+                response = self.send_request(method, url, **kwargs)
+        # the breaker already saw the failed attempts through CountingRetry
+        except requests.Timeout:
+            self.count('timeouts')
+            raise
+        except requests.ConnectionError as e:
+            # a read timeout that exhausted the retries comes wrapped in a MaxRetryError
+            reason = getattr(e.args[0], 'reason', None) if e.args else None
+            self.count('timeouts' if isinstance(reason, ReadTimeoutError) else 'errors')
+            raise
+        self.breaker.record(host, ok=response.status_code < 500)
+        return response
+
+    def send_request(self, method, url, **kwargs):
+        self.count('requests')
+        return super(ResilientSession, self).request(method, url, **kwargs)
+
+    def enter_hedge_pool(self):
+        """
+        Return the executor for a hedged request, with two threads for every thread sending
+        one, so neither attempt ever waits for a free thread. The pool is replaced by a bigger
+        one as callers are added; the old one keeps serving the requests that hold it and is
+        shut down when the last of them leaves.
+        """
+        with self.lock:
+            self.hedge_callers += 1
+            if self.hedge_callers * 2 > self.hedge_workers:
+                self.hedge_workers = max(self.hedge_callers * 2, self.hedge_workers * 2)
+                self.hedge_executor = ThreadPoolExecutor(max_workers=self.hedge_workers)
+                self.hedge_users[self.hedge_executor] = 0
+            self.hedge_users[self.hedge_executor] += 1
+            return self.hedge_executor
+
+    def leave_hedge_pool(self, executor):
+        with self.lock:
+            self.hedge_callers -= 1
+            self.hedge_users[executor] -= 1
+            if executor is self.hedge_executor or self.hedge_users[executor]:
+                return
+            del self.hedge_users[executor]
+        # a losing duplicate may still be running: let it finish on its own
+        executor.shutdown(wait=False)
+
+    def hedged_request(self, method, url, **kwargs):
+        """
+        Send the request and, if it has not answered `hedge_delay` seconds after it was sent, a
+        duplicate; return the first successful response and close the other one.
+        """
+        executor = self.enter_hedge_pool()
+        try:
+            return self.send_hedged(executor, method, url, **kwargs)
+        finally:
+            self.leave_hedge_pool(executor)
+
+    def send_hedged(self, executor, method, url, **kwargs):
+        started = threading.Event()
+
+        def send_first():
+            started.set()
+            return self.send_request(method, url, **kwargs)
+
+        # each request runs in a copy of the caller's context, so context variables such as
+        # the run report's current stage still apply to it
+        first = executor.submit(contextvars.copy_context().run, send_first)
+        # the delay counts from when the request is sent, not from when it was queued
+        started.wait()
+        done, pending = wait([first], timeout=self.hedge_delay)
+        if done:
+            return first.result()
+        self.count('hedged')
+        second = executor.submit(contextvars.copy_context().run, self.send_request, method, url, **kwargs)
+        futures = [first, second]
+        while futures:
+            done, pending = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                futures.remove(future)
+                if future.exception() is None or not futures:
+                    if future is second:
+                        self.count('hedges_won')
+                    for other in futures:
+                        other.add_done_callback(lambda f: f.exception() or f.result().close())
+                    return future.result()
+
+    def print_summary(self):
+        print("HTTP requests: {requests} sent, {retries} retries, {timeouts} timed out, {errors} failed, "
+              "{hedged} hedged ({hedges_won} answered first by the duplicate), circuit breaker opened {} times".format(
+                  self.breaker.trips, **self.stats))
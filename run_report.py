@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-stage timing and request accounting for a chef run.
+
+Work is wrapped in `report.stage(name, sim=...)` blocks; responses of the
+shared session are attributed to the innermost stage of the context (thread,
+or copied context of a hedged request) they were sent from. At the end of a run the report is written as JSON and summarized as
+a table of the slowest stages and sims, which tells whether time went to the
+PhET API, translation or local CPU.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+RUN_REPORT_PATH = 'chefdata/run_report_{}.json'
+
+
+class RunReport(object):
+
+    def __init__(self, language):
+        self.language = language
+        self.lock = threading.Lock()
+        # names of the stages entered, innermost last
+        self.stack = contextvars.ContextVar('run_report_stack_{}'.format(id(self)), default=())
+        self.started = time.time()
+        self.stages = {}
+        self.sims = {}
+
+    def _stage_totals(self, name):
+        return self.stages.setdefault(name, {
+            'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+            'requests': 0, 'bytes': 0, 'retries': 0, 'cache_hits': 0,
+        })
+
+    @contextmanager
+    def stage(self, name, sim=None):
+        """
+        Time the enclosed block as one call of stage `name`, also adding it to the total
+        of `sim` if given.
+        """
+        token = self.stack.set(self.stack.get() + (name,))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stack.reset(token)
+            self.add_time(name, time.perf_counter() - start, sim=sim)
+
+    def add_time(self, name, seconds, sim=None):
+        with self.lock:
+            totals = self._stage_totals(name)
+            totals['calls'] += 1
+            totals['seconds'] += seconds
+            totals['max_seconds'] = max(totals['max_seconds'], seconds)
+            if sim is not None:
+                sim_totals = self.sims.setdefault(str(sim), {})
+                sim_totals[name] = sim_totals.get(name, 0.0) + seconds
+
+    def record_response(self, response, *args, **kwargs):
+        """
+        Response hook for the shared session: counts the request, its body size, the
+        retries urllib3 made for it and whether it came from the HTTP cache. Streamed
+        responses are counted by their Content-Length, so their body is not read here.
+        """
+        stack = self.stack.get()
+        name = stack[-1] if stack else 'other'
+        retries = getattr(response.raw, 'retries', None)
+        if kwargs.get('stream'):
+            size = int(response.headers.get('Content-Length') or 0)
+        else:
+            size = len(response.content)
+        with self.lock:
+            totals = self._stage_totals(name)
+            totals['requests'] += 1
+            totals['bytes'] += size
+            totals['retries'] += len(retries.history) if retries else 0
+            totals['cache_hits'] += 1 if getattr(response, 'from_cache', False) else 0
+        return response
+
+    def as_dict(self):
+        return {
+            'language': self.language,
+            'started': self.started,
+            'wall_seconds': time.time() - self.started,
+            'stages': self.stages,
+            'sims': self.sims,
+        }
+
+    def save(self, path=None):
+        path = path or RUN_REPORT_PATH.format(self.language)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(), f, indent=1, sort_keys=True, ensure_ascii=False)
+        return path
+
+    def print_summary(self, top=10):
+        print("Run report ({}), {:.1f}s wall time:".format(self.language, time.time() - self.started))
+        print("\t{:<16} {:>6} {:>9} {:>9} {:>8} {:>10} {:>7} {:>6}".format(
+            'stage', 'calls', 'total s', 'max s', 'requests', 'MB', 'retries', 'cached'))
+        for name, totals in sorted(self.stages.items(), key=lambda item: -item[1]['seconds']):
+            print("\t{:<16} {calls:>6} {seconds:>9.1f} {max_seconds:>9.2f} {requests:>8} {:>10.1f} "
+                  "{retries:>7} {cache_hits:>6}".format(name, totals['bytes'] / 1024 ** 2, **totals))
+        slowest = sorted(self.sims.items(), key=lambda item: -sum(item[1].values()))[:top]
+        if slowest:
+            print("\tSlowest sims:")
+        for sim, sim_totals in slowest:
+            stages = ", ".join("{} {:.1f}s".format(name, seconds) for name, seconds in
+                               sorted(sim_totals.items(), key=lambda item: -item[1]))
+            print("\t\t{:.1f}s {} ({})".format(sum(sim_totals.values()), sim, stages))
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Result records of built sims, and splitting the sims of a build into shards.
+
+A result holds everything needed to add a sim to the channel tree without any
+network or CPU work: its download URL, the zip and its hash, the resolved
+title, description, authors and thumbnail, and the local primer video. Results
+are appended as JSON lines to a `ResultLog`, which is how shard builds hand
+their sims to the merge step and how an interrupted build resumes from its
+journal.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+SHARD_DIR = 'chefdata/shards'
+
+
+def parse_shard(value):
+    """
+    Parse a `--shard` value `i/N` into (i, N), with shards numbered from 0 to N - 1.
+    """
+    index, count = [int(part) for part in value.split('/')]
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("Invalid shard {!r}: expected i/N with 0 <= i < N".format(value))
+    return index, count
+
+
+def shard_of(sim_id, count):
+    """
+    Return the shard a sim is built by, the same in every process and on every machine.
+    """
+    return int(hashlib.sha1(str(sim_id).encode('utf-8')).hexdigest(), 16) % count
+
+
+def shard_results_path(shard_dir, language, index, count):
+    return os.path.join(shard_dir, 'results_{}_{}of{}.jsonl'.format(language, index, count))
+
+
+def make_result(sim_id, language, download_url, zippath, html_hash, record, video_path=None, rules_hash=None):
+    return {
+        'sim_id': sim_id,
+        'language': language,
+        'download_url': download_url,
+        'zippath': zippath,
+        'html_hash': html_hash,
+        'record': record,
+        'video_path': video_path,
+        'rules_hash': rules_hash,
+    }
+
+
+class ResultLog(object):
+    """
+    Append-only JSON lines file of sim results. Every result is flushed as soon as it is
+    appended, and also synced to disk if `fsync` is set.
+    """
+
+    def __init__(self, path, mode='a', fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if mode == 'a' and os.path.exists(path):
+            drop_torn_line(path)
+        self.file = open(path, mode, encoding='utf-8')
+
+    def append(self, result):
+        line = json.dumps(result, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    @staticmethod
+    def read(path):
+        """
+        Return the results in the log at `path`, ignoring a last line cut short by a crash.
+        """
+        results = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    results.append(json.loads(line))
+                except ValueError:
+                    break
+        return results
+
+
+def drop_torn_line(path):
+    """
+    Truncate the file at `path` after its last complete line, so that results appended after
+    a crash start on a line of their own.
+    """
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            f.truncate(end)
+
+
+def read_shard_results(shard_dir, language):
+    """
+    Return the results written by the finished shards of `language` in `shard_dir`, and
+    raise a ValueError if the shards of a split are missing or were split differently.
+    """
+    # anchored, so that the results of pt_BR are not taken for those of pt
+    pattern = re.compile(r'^results_{}_(\d+)of(\d+)\.jsonl$'.format(re.escape(language)))
+    shards = set()
+    for name in os.listdir(shard_dir):
+        match = pattern.match(name)
+        if match:
+            shards.add((int(match.group(1)), int(match.group(2))))
+    counts = {count for index, count in shards}
+    if len(counts) != 1:
+        raise ValueError("Expected the results of one shard split of {} in {}, found {}".format(
+            language, shard_dir, sorted(shards) or "none"))
+    count = counts.pop()
+    missing = sorted(set(range(count)) - {index for index, count in shards})
+    if missing:
+        raise ValueError("Shards {} of {} for {} have not finished".format(missing, count, language))
+    results = []
+    for index in range(count):
+        results.extend(ResultLog.read(shard_results_path(shard_dir, language, index, count)))
+    return results
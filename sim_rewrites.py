@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The offline rewrites applied to every sim's HTML.
+
+The rules live here, apart from the chef, so that tools checking built sims
+(see `verify_zips.py`) use the same rules as the build without importing
+ricecooker.
+"""
+
+import heapq
+import io
+import re
+
+
+# rewrites applied wherever they occur in the sim HTML, as (pattern, replacement)
+DOCUMENT_REWRITES = [
+    # remove "are we online" check
+    (re.compile(re.escape("check:function(){var t=this")), "check:function(){return;var t=this"),
+    # remove online links from "about" modal
+    (re.compile(re.escape("getLinks:function(")), "getLinks:function(){return [];},doNothing:function("),
+    # setting up the query parameters for cases in which it works
+    (re.compile(r"(this\.getAllForString\([^,]+,[^w]*)(window\.location\.search)(\s*\))"),
+     r"\1window.location.search === '' ? '?allowLinks=false&disableFullscreen' : window.location.search\3"),
+]
+
+# remove menu options that link to online resources from the script that mentions
+# phetWebsite (fallbacks in case the above regex work fails)
+PHET_WEBSITE_REMOVALS = [
+    re.compile('tandem: e.createTandem\(\"screenshotMenuItem\"\),'),
+    re.compile('tandem: e.createTandem\(\"fullScreenMenuItem\"\),'),
+    re.compile('string!JOIST/menuItem.reportAProblem'),
+    re.compile('string!JOIST/menuItem.phetWebsite'),
+]
+
+# what marks the <script> elements that are removed, and the one whose menu items are
+ANALYTICS_MARKER = "analytics.js"
+PHET_WEBSITE_MARKER = "phetWebsite"
+
+SCRIPT_START_PATTERN = re.compile(r"<script\b[^>]*>", re.IGNORECASE)
+SCRIPT_END_PATTERN = re.compile(r"</script\s*>", re.IGNORECASE)
+
+
+# the document rewrites followed by the removals, as (pattern, replacement)
+PHET_WEBSITE_RULES = DOCUMENT_REWRITES + [(pattern, "") for pattern in PHET_WEBSITE_REMOVALS]
+
+
+def find_edits(content, rules, pos, endpos):
+    """
+    Return the (start, end, replacement) of the matches of `rules` in `content[pos:endpos]`,
+    in order. Each rule scans with its own pattern, as `re` finds a literal much faster than
+    an alternation of all of them.
+    """
+    return heapq.merge(*[find_rule_edits(content, pattern, replacement, pos, endpos) for pattern, replacement in rules])
+
+
+def find_rule_edits(content, pattern, replacement, pos, endpos):
+    for match in pattern.finditer(content, pos, endpos):
+        yield match.start(), match.end(), match.expand(replacement)
+
+
+def iter_edits(content):
+    """
+    Yield the (start, end, replacement) of the spans of `content` to change, in order.
+    """
+    # where the document rewrites resume, after the last script handled on its own
+    pos = 0
+    script_pos = 0
+    while True:
+        match = SCRIPT_START_PATTERN.search(content, script_pos)
+        if not match:
+            break
+        script_end = SCRIPT_END_PATTERN.search(content, match.end())
+        body_end = script_end.start() if script_end else len(content)
+        script_pos = script_end.end() if script_end else len(content)
+        if content.find(ANALYTICS_MARKER, match.start(), script_pos) != -1:
+            # remove Google Analytics and online image bug requests
+            yield from find_edits(content, DOCUMENT_REWRITES, pos, match.start())
+            yield match.start(), script_pos, ""
+        elif content.find(PHET_WEBSITE_MARKER, match.start(), script_pos) != -1:
+            yield from find_edits(content, DOCUMENT_REWRITES, pos, match.end())
+            yield from find_edits(content, PHET_WEBSITE_RULES, match.end(), body_end)
+        else:
+            # other scripts only get the document rewrites
+            continue
+        pos = script_pos
+    yield from find_edits(content, DOCUMENT_REWRITES, pos, len(content))
+
+
+def rewrite_sim_html(content):
+    """
+    Apply the offline rewrites to a sim's HTML without parsing it: the rules only locate
+    the spans to change (document rewrites, `<script>` elements loading analytics, and the
+    `phetWebsite` script's online menu items), and the output is written once, in order,
+    from those edits and the untouched text between them.
+    """
+    output = io.StringIO()
+    last = 0
+    for start, end, text in iter_edits(content):
+        output.write(content[last:start])
+        output.write(text)
+        last = end
+    output.write(content[last:])
+    return output.getvalue()
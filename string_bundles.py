@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Pruning of the translated string tables embedded in built PhET sims.
+
+A built sim carries the strings of every locale it is translated to in one
+`phet.chipper.strings = {...}` object literal, while a channel only ever shows
+its own language, with English as the fallback. `prune_string_bundles` keeps
+just those tables and checks that the sim can still start with them; if the
+object cannot be found, decoded or safely rewritten, the HTML is left as is.
+"""
+
+import json
+import re
+
+STRINGS_PATTERN = re.compile(r"(?:window\.)?phet\.chipper\.strings\s*=\s*")
+BOOT_LOCALE_PATTERN = re.compile(r"""(?:window\.)?phet\.chipper\.locale\s*=\s*["']([^"']+)["']""")
+FALLBACK_LOCALE = 'en'
+
+
+def keeps_locale(locale, language):
+    """
+    Whether the string table of `locale` is needed by a channel in `language`: the English
+    fallback and every variant of the language itself (e.g. ar, ar_SA and ar_MA for ar).
+    """
+    return locale == FALLBACK_LOCALE or locale.split('_')[0] == language.split('_')[0]
+
+
+def encode_strings(strings):
+    """
+    Serialize string tables to go back inside a `<script>` element, as compact UTF-8
+    JSON that cannot close the element or break a JavaScript string literal.
+    """
+    text = json.dumps(strings, ensure_ascii=False, separators=(',', ':'))
+    return text.replace('</', '<\\/').replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+def check_pruned(content, start, kept, boot_locale, locales):
+    """
+    Return None if the pruned HTML can still boot, otherwise why not: the string object
+    must decode to exactly the tables kept, with the fallback and the sim's boot locale
+    (if it was among the original `locales`) still there, and it must not end its
+    `<script>` element early.
+    """
+    try:
+        decoded, end = json.JSONDecoder().raw_decode(content, start)
+    except ValueError as e:
+        return "the pruned strings do not decode ({})".format(e)
+    if decoded != kept:
+        return "the pruned strings do not decode to the kept tables"
+    if FALLBACK_LOCALE not in kept:
+        return "there are no {} strings to fall back to".format(FALLBACK_LOCALE)
+    if boot_locale in locales and boot_locale not in kept:
+        return "the sim boots in {}, whose strings were removed".format(boot_locale)
+    if re.search(r"</script", content[start:end], re.IGNORECASE):
+        return "the pruned strings close their <script> element"
+    return None
+
+
+def prune_string_bundles(content, language):
+    """
+    Remove from a sim's HTML the string tables of the locales a `language` channel never
+    shows. Returns the new HTML, the locales removed and the reason the HTML was left
+    unchanged if the result failed its checks (None if it passed).
+    """
+    match = STRINGS_PATTERN.search(content)
+    if not match:
+        return content, [], None
+    try:
+        strings, end = json.JSONDecoder().raw_decode(content, match.end())
+    except ValueError as e:
+        return content, [], "the strings do not decode ({})".format(e)
+    if not isinstance(strings, dict):
+        return content, [], "the strings are not an object"
+
+    kept = {locale: table for locale, table in strings.items() if keeps_locale(locale, language)}
+    removed = [locale for locale in strings if locale not in kept]
+    if not removed:
+        return content, [], None
+    pruned = content[:match.end()] + encode_strings(kept) + content[end:]
+
+    boot_locale = BOOT_LOCALE_PATTERN.search(content)
+    problem = check_pruned(pruned, match.end(), kept, boot_locale.group(1) if boot_locale else None, strings)
+    if problem:
+        return content, [], problem
+    return pruned, removed, None
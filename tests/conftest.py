@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the chef's modules live at the top of the repo, next to chef.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,59 @@
+"""
+Tests for `CategoryIndex.select` on a small categories payload.
+"""
+
+import pytest
+
+from category_index import CategoryIndex
+
+
+def category(name, children=(), sims=()):
+    return {"name": name, "childrenIds": list(children), "simulationIds": list(sims)}
+
+
+CATEGORIES = {
+    "1": category("root", children=[2, 3, 6]),
+    "2": category("physics", children=[4, 5]),
+    "3": category("chemistry", sims=[13]),
+    "4": category("motion", sims=[10, 11]),
+    "5": category("sound-and-waves", sims=[11, 12]),
+    "6": category("new", sims=[14]),
+}
+
+
+@pytest.fixture
+def index():
+    return CategoryIndex(CATEGORIES, blacklist=["new"])
+
+
+def test_selects_everything_without_filters(index):
+    assert index.select() is None
+
+
+def test_selects_a_subtree_with_the_path_to_the_root(index):
+    assert index.select(["physics"]) == {1, 2, 4, 5}
+    assert index.select([3]) == {1, 3}
+
+
+def test_selects_the_categories_of_a_sim(index):
+    assert index.select(only_sims=[11]) == {1, 2, 4, 5}
+
+
+def test_mixed_filters_select_the_sims_in_the_categories(index):
+    assert index.select(["physics"], [10]) == {1, 2, 4}
+    assert index.select(["motion", "chemistry"], [11, 13]) == {1, 2, 3, 4}
+
+
+def test_rejects_unknown_categories(index):
+    with pytest.raises(ValueError, match="No category new"):
+        index.select(["new"])
+
+
+def test_rejects_sims_in_no_category(index):
+    with pytest.raises(ValueError, match="Sims 14"):
+        index.select(only_sims=[14])
+
+
+def test_rejects_filters_that_select_nothing(index):
+    with pytest.raises(ValueError, match="contain none of the sims"):
+        index.select(["chemistry"], [10])
@@ -0,0 +1,71 @@
+"""
+Regression tests for `rewrite_sim_html` against the BeautifulSoup implementation of
+`process_sim_html` it replaced, on the saved sim HTML in `sim_html/`.
+"""
+
+import os
+import re
+
+import pytest
+from bs4 import BeautifulSoup
+
+from sim_rewrites import rewrite_sim_html
+
+SIM_HTML_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim_html')
+SIM_HTML_FILES = sorted(name for name in os.listdir(SIM_HTML_DIR) if name.endswith('.html'))
+SCRIPT_ELEMENT_PATTERN = re.compile(r"<script\b.*?</script\s*>", re.IGNORECASE | re.DOTALL)
+
+
+def legacy_process_sim_html(content):
+    """
+    The rewrites of `process_sim_html` before `rewrite_sim_html`, as they were.
+    """
+    content = content.replace("check:function(){var t=this", "check:function(){return;var t=this")
+    content = content.replace("getLinks:function(", "getLinks:function(){return [];},doNothing:function(")
+    regex = r"(this\.getAllForString\([^,]+,[^w]*)(window\.location\.search)(\s*\))"
+    replacement = r"\1window.location.search === '' ? '?allowLinks=false&disableFullscreen' : window.location.search\3"
+    content = re.sub(regex, replacement, content)
+    soup = BeautifulSoup(content, "html.parser")
+    for script in soup.find_all("script"):
+        if "analytics.js" in str(script):
+            script.extract()
+        if 'phetWebsite' in str(script):
+            script.string = re.compile(r'tandem: e.createTandem\("screenshotMenuItem"\),').sub("", script.string)
+            script.string = re.compile(r'tandem: e.createTandem\("fullScreenMenuItem"\),').sub("", script.string)
+            script.string = re.compile('string!JOIST/menuItem.reportAProblem').sub("", script.string)
+            script.string = re.compile('string!JOIST/menuItem.phetWebsite').sub("", script.string)
+    return str(soup)
+
+
+def read_sim_html(name):
+    with open(os.path.join(SIM_HTML_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def normalize(html):
+    return str(BeautifulSoup(html, "html.parser"))
+
+
+@pytest.mark.parametrize('name', SIM_HTML_FILES)
+def test_matches_legacy_process_sim_html(name):
+    content = read_sim_html(name)
+    assert normalize(rewrite_sim_html(content)) == normalize(legacy_process_sim_html(content))
+
+
+@pytest.mark.parametrize('name', SIM_HTML_FILES)
+def test_keeps_markup_outside_scripts_byte_identical(name):
+    content = read_sim_html(name)
+    assert SCRIPT_ELEMENT_PATTERN.sub("", rewrite_sim_html(content)) == SCRIPT_ELEMENT_PATTERN.sub("", content)
+
+
+def test_leaves_sim_without_online_code_unchanged():
+    content = read_sim_html('untouched_en.html')
+    assert rewrite_sim_html(content) == content
+
+
+def test_applies_interleaved_rules_in_the_phet_website_script():
+    content = ('<html><body><script>getLinks:function(a){}</script><script>var phetWebsite;'
+               'string!JOIST/menuItem.reportAProblem check:function(){var t=this;'
+               'tandem: e.createTandem("screenshotMenuItem"), getLinks:function(b){}</script>'
+               '<p>check:function(){var t=this</p></body></html>')
+    assert normalize(rewrite_sim_html(content)) == normalize(legacy_process_sim_html(content))
@@ -0,0 +1,35 @@
+"""
+Tests for `select_rendition` on the `simPrimerVimeoData` of a sim.
+"""
+
+from videos import select_rendition
+
+VIMEO_DATA = {
+    "duration": 100,
+    "files": [
+        {"link": "360.mp4", "type": "video/mp4", "height": 360, "size": 5000000},
+        {"link": "540.mp4", "type": "video/mp4", "height": 540, "size": 12000000},
+        {"link": "720.mp4", "type": "video/mp4", "height": 720, "size": 25000000},
+        {"link": "540.m3u8", "type": "application/x-mpegURL", "height": 540},
+    ],
+}
+
+
+def test_picks_the_tallest_mp4_up_to_the_preferred_height():
+    assert select_rendition(VIMEO_DATA) == "540.mp4"
+    assert select_rendition(VIMEO_DATA, preferred_height=1080) == "720.mp4"
+
+
+def test_stays_within_the_size_and_bitrate_budget():
+    assert select_rendition(VIMEO_DATA, max_bytes=10000000) == "360.mp4"
+    # 12 MB over 100 s is 960 kbps
+    assert select_rendition(VIMEO_DATA, max_kbps=900) == "360.mp4"
+
+
+def test_falls_back_to_the_smallest_mp4():
+    assert select_rendition(VIMEO_DATA, max_bytes=1000000) == "360.mp4"
+
+
+def test_returns_none_without_mp4_renditions():
+    assert select_rendition({"files": [{"link": "540.m3u8", "type": "application/x-mpegURL"}]}) is None
+    assert select_rendition({}) is None
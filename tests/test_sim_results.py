@@ -0,0 +1,43 @@
+"""
+Tests for `read_shard_results` on the result files of finished shards.
+"""
+
+import pytest
+
+from sim_results import ResultLog, make_result, read_shard_results, shard_results_path
+
+
+def write_shard(shard_dir, language, index, count, sim_ids):
+    log = ResultLog(shard_results_path(str(shard_dir), language, index, count), mode="w")
+    for sim_id in sim_ids:
+        log.append(make_result(sim_id, language, "https://phet/{}".format(sim_id), "{}.zip".format(sim_id),
+                               "hash", {"title": str(sim_id)}, rules_hash="rules"))
+    log.close()
+
+
+def test_reads_every_shard_of_the_language(tmp_path):
+    write_shard(tmp_path, "pt", 0, 2, [1, 3])
+    write_shard(tmp_path, "pt", 1, 2, [2])
+    # another language whose name starts like it
+    write_shard(tmp_path, "pt_BR", 0, 1, [4])
+    assert [result["sim_id"] for result in read_shard_results(str(tmp_path), "pt")] == [1, 3, 2]
+    assert [result["sim_id"] for result in read_shard_results(str(tmp_path), "pt_BR")] == [4]
+
+
+def test_rejects_unfinished_shards(tmp_path):
+    write_shard(tmp_path, "en", 0, 3, [1])
+    write_shard(tmp_path, "en", 2, 3, [3])
+    with pytest.raises(ValueError, match=r"Shards \[1\] of 3"):
+        read_shard_results(str(tmp_path), "en")
+
+
+def test_rejects_shards_of_different_splits(tmp_path):
+    write_shard(tmp_path, "en", 0, 2, [1])
+    write_shard(tmp_path, "en", 0, 3, [1])
+    with pytest.raises(ValueError, match="one shard split"):
+        read_shard_results(str(tmp_path), "en")
+
+
+def test_rejects_a_directory_without_results(tmp_path):
+    with pytest.raises(ValueError, match="none"):
+        read_shard_results(str(tmp_path), "en")
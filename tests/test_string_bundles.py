@@ -0,0 +1,48 @@
+"""
+Tests for `prune_string_bundles` on small sims with a `phet.chipper.strings` object.
+"""
+
+import json
+
+from string_bundles import STRINGS_PATTERN, prune_string_bundles
+
+
+def make_sim_html(strings, boot_locale='en'):
+    return ('<html><head><script>window.phet.chipper.locale = "{}";\n'
+            'window.phet.chipper.strings = {};\nwindow.phet.chipper.start();</script></head></html>').format(
+                boot_locale, json.dumps(strings))
+
+
+def read_strings(html):
+    return json.JSONDecoder().raw_decode(html, STRINGS_PATTERN.search(html).end())[0]
+
+
+def test_keeps_the_language_variants_and_english():
+    strings = {locale: {'title': locale} for locale in ['en', 'ar', 'ar_SA', 'fr', 'pt_BR', 'en_CA']}
+    html, removed, problem = prune_string_bundles(make_sim_html(strings, boot_locale='ar'), 'ar')
+    assert problem is None
+    assert sorted(removed) == ['en_CA', 'fr', 'pt_BR']
+    assert sorted(read_strings(html)) == ['ar', 'ar_SA', 'en']
+
+
+def test_escapes_strings_that_would_close_the_script():
+    strings = {'en': {'title': 'a</script><script>alert(1)</script>', 'line': 'a\u2028b'}, 'fr': {'title': 'b'}}
+    html, removed, problem = prune_string_bundles(make_sim_html(strings), 'en')
+    assert problem is None
+    assert removed == ['fr']
+    assert html.lower().count('</script') == 1
+    assert '\u2028' not in html
+    assert read_strings(html) == {'en': strings['en']}
+
+
+def test_refuses_to_remove_the_boot_locale():
+    content = make_sim_html({'en': {'title': 'en'}, 'fr': {'title': 'fr'}, 'ar': {'title': 'ar'}}, boot_locale='fr')
+    html, removed, problem = prune_string_bundles(content, 'ar')
+    assert html == content
+    assert removed == []
+    assert 'fr' in problem
+
+
+def test_leaves_sim_without_strings_unchanged():
+    content = '<html><script>var x = 1;</script></html>'
+    assert prune_string_bundles(content, 'ar') == (content, [], None)
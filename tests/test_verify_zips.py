@@ -0,0 +1,38 @@
+"""
+Tests for the verifier's `check_html` on the saved sim HTML in `sim_html/`.
+"""
+
+import os
+
+import pytest
+
+from sim_rewrites import rewrite_sim_html
+from verify_zips import check_html
+
+SIM_HTML_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim_html')
+SIM_HTML_FILES = sorted(name for name in os.listdir(SIM_HTML_DIR) if name.endswith('.html'))
+
+
+def read_sim_html(name):
+    with open(os.path.join(SIM_HTML_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('name', SIM_HTML_FILES)
+def test_passes_rewritten_sims(name):
+    assert check_html(rewrite_sim_html(read_sim_html(name))) == []
+
+
+def test_finds_the_rewrites_left_to_apply():
+    checks = {check for check, detail in check_html(read_sim_html('analytics-and-links_en.html'))}
+    assert {'analytics', 'document-rewrite'} <= checks
+
+
+def test_finds_the_online_menu_items_left():
+    checks = {check for check, detail in check_html(read_sim_html('phet-website-menu_ar.html'))}
+    assert 'online-menu' in checks
+
+
+def test_finds_online_resources():
+    problems = check_html('<html><img src="https://phet.colorado.edu/logo.png"><script src="//cdn/x.js"></script></html>')
+    assert problems == [('online-url', '2 online resources, e.g. //cdn/x.js, https://phet.colorado.edu/logo.png')]
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Local, content-addressed cache of sim thumbnails and tiled topic thumbnails.
+
+All the `simImages` thumbnails of a build are fetched up front in parallel and
+kept under the SHA-256 of their content, with an index from URL to file, so a
+sim image is downloaded once however many sims, videos and topics use it and
+is not downloaded again on later runs. Topic thumbnails are tiled from these
+files the way ricecooker's `derive_thumbnail` would, without it having to
+fetch every descendant's image again at upload time.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from ricecooker.utils.images import ThumbnailGenerationError, create_tiled_image
+
+THUMBNAIL_STORE_DIR = 'chefdata/thumbnails'
+THUMBNAIL_MAX_WORKERS = 8
+
+
+class ThumbnailStore(object):
+
+    def __init__(self, directory=THUMBNAIL_STORE_DIR, get=requests.get):
+        self.directory = directory
+        self.get = get
+        self.lock = threading.Lock()
+        self.index_path = os.path.join(directory, 'index.json')
+        self.index = {}
+        self.fetched = 0
+        self.tiled_count = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    def get_path(self, url):
+        """
+        Return the local file for `url` if it has been fetched, otherwise None.
+        """
+        path = self.index.get(url)
+        return path if path and os.path.exists(path) else None
+
+    def fetch(self, url):
+        """
+        Fetch the image at `url` into the store and return its path, or None on failure.
+        """
+        path = self.get_path(url)
+        if path:
+            return path
+        try:
+            response = self.get(url)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print("\tThumbnail download of {} failed: {}".format(url, e))
+            return None
+        content = response.content
+        extension = os.path.splitext(url.split('?')[0])[1] or '.png'
+        path = os.path.join(self.directory, hashlib.sha256(content).hexdigest() + extension)
+        if not os.path.exists(path):
+            # created on first use, so chefs that never fetch a thumbnail leave no directory behind
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        with self.lock:
+            self.index[url] = path
+            self.fetched += 1
+        return path
+
+    def fetch_all(self, urls, max_workers=THUMBNAIL_MAX_WORKERS):
+        """
+        Fetch every URL in `urls` concurrently and return {url: local path} for those that
+        succeeded.
+        """
+        urls = list(dict.fromkeys(urls))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            paths = dict(zip(urls, executor.map(self.fetch, urls)))
+        self.save()
+        return {url: path for url, path in paths.items() if path}
+
+    def tiled(self, paths):
+        """
+        Return a tiled thumbnail of the first 4 images in `paths` (or of the first one if
+        there are fewer), as ricecooker tiles topic thumbnails, or None if there are none
+        or tiling fails. Tiles of the same images are only generated once.
+        """
+        paths = list(dict.fromkeys(paths))
+        count = 4 if len(paths) >= 4 else 1
+        if not paths:
+            return None
+        sources = paths[:count]
+        key = hashlib.sha256('\n'.join(os.path.basename(path) for path in sources).encode('utf-8')).hexdigest()
+        path = os.path.join(self.directory, 'tiled-{}.png'.format(key))
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = os.path.join(self.directory, 'tiled-{}.tmp.png'.format(key))
+            try:
+                create_tiled_image(sources, tmp_path)
+            except ThumbnailGenerationError as e:
+                print("\tTiled thumbnail of {} failed: {}".format(", ".join(sources), e))
+                return None
+            os.replace(tmp_path, path)
+            self.tiled_count += 1
+        return path
+
+    def reset_counts(self):
+        with self.lock:
+            self.fetched = 0
+            self.tiled_count = 0
+
+    def save(self):
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.index, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.index_path)
+
+    def print_summary(self, count):
+        print("Thumbnails: {} in {}, {} fetched and {} topic thumbnails tiled this run".format(
+            count, self.directory, self.fetched, self.tiled_count))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Batched machine translation with a persistent translation memory.
+
+The chef collects every string it will need translated for a run and
+translates them up front with `translate_batch`; the results are stored on disk
+keyed by (source text, target language), so repeated sims and repeated runs
+are answered from the memory without calling the translation service.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from deep_translator import GoogleTranslator
+
+TRANSLATION_MEMORY_PATH = '.translation_memory.json'
+TRANSLATION_WORKERS = 4
+
+
+class TranslationMemory(object):
+    """
+    Drop-in replacement for the `GoogleTranslator.translate` calls in the chef, backed
+    by a JSON file of {target language: {source text: translation}}. New strings are
+    translated with `translator_class`, which takes the `GoogleTranslator` arguments.
+    """
+
+    def __init__(self, target, source='auto', path=TRANSLATION_MEMORY_PATH, translator_class=GoogleTranslator):
+        self.source = source
+        self.target = target
+        self.path = path
+        self.translator_class = translator_class
+        # a GoogleTranslator keeps the parameters of its current request, so each thread gets its own
+        self.thread_translators = threading.local()
+        self.lock = threading.Lock()
+        self.cached = 0
+        self.fresh = 0
+        # the strings already counted as cached or fresh, as a string is looked up several times per run
+        self.counted = set()
+        self.memory = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.memory = json.load(f)
+        self.translations = self.memory.setdefault(target, {})
+
+    def translate_batch(self, texts, max_workers=TRANSLATION_WORKERS):
+        """
+        Translate all `texts` that are not in the memory yet on `max_workers` threads, and
+        save the memory. Returns the translations in the same order as `texts`.
+        """
+        # GoogleTranslator.translate_batch is a serial loop that sleeps after every string
+        # (deep_translator 1.5), so the pending strings are translated one by one, concurrently
+        with self.lock:
+            unique = [text for text in dict.fromkeys(texts) if text]
+            pending = [text for text in unique if text not in self.translations]
+            for text in unique:
+                if text not in pending:
+                    self.count(text, fresh=False)
+        try:
+            if pending:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    for text, translated in zip(pending, executor.map(self.translate_fresh, pending)):
+                        with self.lock:
+                            self.translations[text] = translated
+                            self.count(text, fresh=True)
+        finally:
+            # keep what was translated even if the service failed partway
+            if pending:
+                self.save()
+        return [self.translations.get(text, text) if text else text for text in texts]
+
+    def translate(self, text, **kwargs):
+        with self.lock:
+            if text in self.translations:
+                self.count(text, fresh=False)
+                return self.translations[text]
+        translated = self.translate_fresh(text, **kwargs)
+        with self.lock:
+            self.translations[text] = translated
+            self.count(text, fresh=True)
+        return translated
+
+    def count(self, text, fresh):
+        # called with the lock held
+        if text in self.counted:
+            return
+        self.counted.add(text)
+        if fresh:
+            self.fresh += 1
+        else:
+            self.cached += 1
+
+    def translate_fresh(self, text, **kwargs):
+        translator = getattr(self.thread_translators, 'translator', None)
+        if translator is None:
+            translator = self.thread_translators.translator = self.translator_class(
+                source=self.source, target=self.target)
+        return translator.translate(text=text, **kwargs)
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.memory, f, ensure_ascii=False, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    def print_summary(self):
+        print("Translations ({}): {} strings from memory, {} fresh".format(self.target, self.cached, self.fresh))
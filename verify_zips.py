@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Post-build verifier for the HTML5 zips of the sims.
+
+Checks every zip in parallel, reading its entries straight from the archive:
+
+- structure: a readable zip with an `index.html`, every entry deflated,
+  passing its CRC check and carrying the neutral timestamp of ricecooker's
+  predictable zips;
+- rewrites: every rule of `sim_rewrites` was applied: the document rewrites,
+  the removal of analytics scripts and of the `phetWebsite` script's online
+  menu items;
+- online URLs: no script, image, stylesheet or media element still loads
+  from the network.
+
+    python verify_zips.py chefdata/zips --workers 8
+
+It shares the rules with the chef through `sim_rewrites`, but does not import
+the chef (or ricecooker), so it can run next to a build.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from sim_rewrites import (
+    ANALYTICS_MARKER, DOCUMENT_REWRITES, PHET_WEBSITE_MARKER, PHET_WEBSITE_REMOVALS, SCRIPT_END_PATTERN,
+    SCRIPT_START_PATTERN)
+
+ZIP_DIR = 'chefdata/zips'
+# the date_time ricecooker's write_file_to_zip_with_neutral_metadata gives every entry
+NEUTRAL_DATE_TIME = (2015, 10, 21, 7, 28, 0)
+
+# resources the sim would load from the network (links the user may follow are left alone)
+ONLINE_URL_PATTERN = re.compile(
+    r"""<(?:script|img|link|iframe|audio|video|source)\b[^>]*?\b(?:src|href)\s*=\s*["']?((?:https?:)?//[^"'\s>]+)""",
+    re.IGNORECASE)
+
+
+def iter_scripts(html):
+    """
+    Yield the (element, body) of every `<script>` element, the way `rewrite_sim_html` finds them.
+    """
+    pos = 0
+    while True:
+        match = SCRIPT_START_PATTERN.search(html, pos)
+        if not match:
+            return
+        script_end = SCRIPT_END_PATTERN.search(html, match.end())
+        pos = script_end.end() if script_end else len(html)
+        yield html[match.start():pos], html[match.end():script_end.start() if script_end else len(html)]
+
+
+def check_html(html):
+    """
+    Return the problems found in a processed sim's HTML, as a list of (check, detail).
+    """
+    problems = []
+    for element, body in iter_scripts(html):
+        if ANALYTICS_MARKER in element:
+            problems.append(('analytics', 'analytics script still present'))
+        elif PHET_WEBSITE_MARKER in body:
+            for pattern in PHET_WEBSITE_REMOVALS:
+                if pattern.search(body):
+                    problems.append(('online-menu', '{} still in the {} script'.format(
+                        pattern.pattern, PHET_WEBSITE_MARKER)))
+    # a document rewrite was applied if wherever its pattern matches, the text is already its replacement
+    for pattern, replacement in DOCUMENT_REWRITES:
+        unapplied = sum(1 for match in pattern.finditer(html)
+                        if not html.startswith(match.expand(replacement), match.start()))
+        if unapplied:
+            problems.append(('document-rewrite', '{} matches of {} not rewritten'.format(unapplied, pattern.pattern)))
+    urls = sorted(set(ONLINE_URL_PATTERN.findall(html)))
+    if urls:
+        problems.append(('online-url', '{} online resources, e.g. {}'.format(len(urls), ', '.join(urls[:3]))))
+    return problems
+
+
+def verify_zip(path):
+    """
+    Check the zip at `path` and return {'path', 'bytes', 'problems'}.
+    """
+    problems = []
+    try:
+        with zipfile.ZipFile(path) as zfile:
+            names = zfile.namelist()
+            if 'index.html' not in names:
+                problems.append(('structure', 'no index.html'))
+            for info in zfile.infolist():
+                if info.date_time != NEUTRAL_DATE_TIME:
+                    problems.append(('structure', '{} has date_time {}'.format(info.filename, info.date_time)))
+                if info.compress_type != zipfile.ZIP_DEFLATED:
+                    problems.append(('structure', '{} is not deflated'.format(info.filename)))
+                # reading an entry to the end also checks its CRC
+                with zfile.open(info) as entry:
+                    content = entry.read()
+                if info.filename == 'index.html':
+                    problems.extend(check_html(content.decode('utf-8', errors='replace')))
+    except (zipfile.BadZipFile, zlib.error, OSError, EOFError) as e:
+        problems.append(('structure', 'unreadable zip: {}'.format(e)))
+    return {'path': path, 'bytes': os.path.getsize(path) if os.path.exists(path) else 0, 'problems': problems}
+
+
+def find_zips(paths):
+    zips = []
+    for path in paths:
+        if not os.path.exists(path):
+            raise FileNotFoundError("No zip or directory {}".format(path))
+        if os.path.isdir(path):
+            for root, dirs, filenames in os.walk(path):
+                zips.extend(os.path.join(root, name) for name in filenames if name.endswith('.zip'))
+        else:
+            zips.append(path)
+    return sorted(zips)
+
+
+def verify_zips(paths, workers=None):
+    """
+    Verify every zip under `paths` (zip files or directories) on a pool of `workers`
+    processes and return the summary.
+    """
+    start = time.perf_counter()
+    zips = find_zips(paths)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(verify_zip, zips, chunksize=4))
+    checks = {}
+    for result in results:
+        for check in {check for check, detail in result['problems']}:
+            checks[check] = checks.get(check, 0) + 1
+    return {
+        'zips': len(results),
+        'failed': sum(1 for result in results if result['problems']),
+        'bytes': sum(result['bytes'] for result in results),
+        'failed_checks': checks,
+        'seconds': time.perf_counter() - start,
+        'results': results,
+    }
+
+
+def print_summary(summary):
+    for result in summary['results']:
+        for check, detail in result['problems']:
+            print("{}: [{}] {}".format(result['path'], check, detail))
+    print("Verified {zips} zips ({:.1f} MB) in {seconds:.1f}s: {} passed, {failed} failed".format(
+        summary['bytes'] / 1024 ** 2, summary['zips'] - summary['failed'], **summary))
+    for check, count in sorted(summary['failed_checks'].items()):
+        print("\t{:<18} {} zips".format(check, count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=[ZIP_DIR], help='Zips or directories of zips to verify.')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes (one per CPU by default).')
+    parser.add_argument('--json', help='Also write the results to this file.')
+    args = parser.parse_args()
+
+    try:
+        summary = verify_zips(args.paths, workers=args.workers)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
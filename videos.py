@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Primer video selection and a local, content-addressed video store.
+
+`select_rendition` picks the Vimeo rendition to publish for a sim's primer
+video within an optional size/bitrate budget. `VideoStore` downloads the
+chosen links concurrently, resuming interrupted downloads with HTTP range
+requests, and keeps each file under the SHA-256 of its content, with an index
+from URL to file so a video is only downloaded once across sims and runs.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+VIDEO_STORE_DIR = 'chefdata/videos'
+PREFERRED_HEIGHT = 540
+DOWNLOAD_ATTEMPTS = 3
+CHUNK_SIZE = 1024 * 1024
+
+
+def select_rendition(vimeo_data, max_bytes=None, max_kbps=None, preferred_height=PREFERRED_HEIGHT):
+    """
+    Return the link of the rendition to use from a sim's `simPrimerVimeoData`: the tallest
+    MP4 no taller than `preferred_height` that fits the budget, else the smallest one.
+    Returns None if there are no renditions.
+    """
+    files = [f for f in vimeo_data.get('files') or [] if f.get('link') and f.get('type', 'video/mp4') == 'video/mp4']
+    if not files:
+        return None
+    duration = vimeo_data.get('duration')
+
+    def fits(f):
+        size = f.get('size')
+        if max_bytes and size and size > max_bytes:
+            return False
+        if max_kbps and size and duration and size * 8 / 1000.0 / duration > max_kbps:
+            return False
+        return (f.get('height') or 0) <= preferred_height
+
+    candidates = [f for f in files if fits(f)]
+    if candidates:
+        best = max(candidates, key=lambda f: (f.get('height') or 0, -(f.get('size') or 0)))
+    else:
+        best = min(files, key=lambda f: (f.get('size') or float('inf'), f.get('height') or 0))
+    return best['link']
+
+
+def sha256_of_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class VideoStore(object):
+
+    def __init__(self, directory=VIDEO_STORE_DIR, get=requests.get):
+        self.directory = directory
+        self.get = get
+        self.lock = threading.Lock()
+        self.index_path = os.path.join(directory, 'index.json')
+        self.index = {}
+        self.downloaded = 0
+        self.resumed = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    def get_path(self, url):
+        """
+        Return the local file for `url` if it has been downloaded, otherwise None.
+        """
+        path = self.index.get(url)
+        return path if path and os.path.exists(path) else None
+
+    def download(self, url):
+        """
+        Download `url` into the store, resuming from a previous partial download if there
+        is one, and return the path of the stored file, or None if every attempt failed.
+        """
+        path = self.get_path(url)
+        if path:
+            return path
+        # created on first use, so chefs that never download a video leave no directory behind
+        os.makedirs(self.directory, exist_ok=True)
+        partial_path = os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.part')
+        for attempt in range(DOWNLOAD_ATTEMPTS):
+            offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+            headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+            try:
+                with self.get(url, headers=headers, stream=True) as response:
+                    if response.status_code == 416:
+                        # the partial file already holds the whole video
+                        break
+                    response.raise_for_status()
+                    resuming = offset and response.status_code == 206
+                    if resuming:
+                        with self.lock:
+                            self.resumed += 1
+                    with open(partial_path, 'ab' if resuming else 'wb') as f:
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            f.write(chunk)
+                break
+            except requests.RequestException as e:
+                print("\tVideo download of {} interrupted (attempt {}): {}".format(url, attempt + 1, e))
+        else:
+            return None
+
+        extension = os.path.splitext(url.split('?')[0])[1] or '.mp4'
+        path = os.path.join(self.directory, sha256_of_file(partial_path) + extension)
+        os.replace(partial_path, path)
+        with self.lock:
+            self.index[url] = path
+            self.downloaded += 1
+        return path
+
+    def download_all(self, urls, max_workers=4):
+        """
+        Download every URL in `urls` concurrently and return {url: local path} for those
+        that succeeded.
+        """
+        urls = list(dict.fromkeys(urls))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            paths = dict(zip(urls, executor.map(self.download, urls)))
+        self.save()
+        return {url: path for url, path in paths.items() if path}
+
+    def reset_counts(self):
+        with self.lock:
+            self.downloaded = 0
+            self.resumed = 0
+
+    def save(self):
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.index, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.index_path)
+
+    def print_summary(self, count):
+        print("Videos: {} in {}, {} downloaded this run ({} resumed)".format(
+            count, self.directory, self.downloaded, self.resumed))
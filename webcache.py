@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Persistent HTTP cache for the chef's shared requests session.
+
+Every URL prefix from `get_cache_policies` gets its own caching adapter (with the
+session's retry strategy), so the metadata listings expire after a short TTL
+while sim HTML, which is addressed by its runUrl, is kept around for good.
+The cache directory is capped in size and evicts least recently used entries.
+"""
+
+import os
+import threading
+from datetime import timedelta
+
+from cachecontrol.heuristics import ExpiresAfter
+from ricecooker.utils.caching import CacheForeverHeuristic, FileCache, CacheControlAdapter
+
+WEBCACHE_DIR = '.webcache'
+WEBCACHE_MAX_BYTES = 2 * 1024 ** 3
+
+
+class LRUFileCache(FileCache):
+    """
+    A `FileCache` that keeps the total size of the cache directory under `max_bytes`,
+    evicting the least recently used entries first. Reads bump an entry's mtime,
+    so mtime order is LRU order, and it survives between runs.
+    """
+
+    def __init__(self, directory, max_bytes=WEBCACHE_MAX_BYTES, **kwargs):
+        super(LRUFileCache, self).__init__(directory, **kwargs)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.total_bytes = sum(size for path, mtime, size in self._entries())
+
+    def _entries(self):
+        for root, dirs, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith('.lock'):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def get(self, key):
+        value = super(LRUFileCache, self).get(key)
+        if value is not None:
+            try:
+                os.utime(self._fn(key))
+            except FileNotFoundError:
+                pass
+        return value
+
+    def set(self, key, value, expires=None):
+        name = self._fn(key)
+        old_size = os.path.getsize(name) if os.path.exists(name) else 0
+        super(LRUFileCache, self).set(key, value)
+        with self.lock:
+            self.total_bytes += len(value) - old_size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def delete(self, key):
+        name = self._fn(key)
+        size = os.path.getsize(name) if os.path.exists(name) else 0
+        super(LRUFileCache, self).delete(key)
+        if not os.path.exists(name):
+            with self.lock:
+                self.total_bytes -= size
+
+    def evict(self):
+        """
+        Remove the oldest entries until the cache is back to 90% of `max_bytes`,
+        so a full cache does not rescan the directory on every write.
+        """
+        target = self.max_bytes * 0.9
+        for path, mtime, size in sorted(self._entries(), key=lambda entry: entry[1]):
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.total_bytes -= size
+            self.evictions += 1
+
+
+class CacheStats(object):
+    """
+    Hit/miss counters per cache policy, filled in by a response hook on the session.
+    """
+
+    def __init__(self, policies):
+        self.policies = policies
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def policy_for(self, url):
+        for prefix, name, heuristic in sorted(self.policies, key=lambda policy: -len(policy[0])):
+            if url.startswith(prefix):
+                return name
+        return 'uncached'
+
+    def record(self, response, *args, **kwargs):
+        name = self.policy_for(response.url)
+        counter = self.hits if getattr(response, 'from_cache', False) else self.misses
+        with self.lock:
+            counter[name] = counter.get(name, 0) + 1
+        return response
+
+    def reset_counts(self):
+        with self.lock:
+            self.hits = {}
+            self.misses = {}
+
+    def print_summary(self, cache=None):
+        print("HTTP cache summary:")
+        for name in sorted(set(self.hits) | set(self.misses)):
+            print("\t{}: {} hits, {} misses".format(name, self.hits.get(name, 0), self.misses.get(name, 0)))
+        if cache is not None:
+            print("\t{:.1f} MB on disk, {} entries evicted".format(cache.total_bytes / 1024 ** 2, cache.evictions))
+
+
+def get_cache_policies(api_url, download_url, metadata_ttl=timedelta(hours=1), detail_ttl=timedelta(days=1)):
+    """
+    Return the (url prefix, name, heuristic) caching rules for the PhET endpoints.
+    """
+    return [
+        (f'{api_url}/partner-services/2.0/metadata/', 'metadata', ExpiresAfter(seconds=metadata_ttl.total_seconds())),
+        (f'{api_url}/partner-services/2.0/metadata/simulations/', 'sim-detail',
+         ExpiresAfter(seconds=detail_ttl.total_seconds())),
+        (f'{download_url}/sims/html/', 'sim-html', CacheForeverHeuristic()),
+    ]
+
+
+def mount_cache(sess, cache, policies, max_retries, pool_maxsize=10):
+    """
+    Mount a caching adapter for every policy on `sess`, keeping `max_retries` and
+    `pool_maxsize` keep-alive connections per host, and return the `CacheStats` that
+    count its hits and misses.
+    """
+    for prefix, name, heuristic in policies:
+        sess.mount(prefix, CacheControlAdapter(
+            cache=cache, heuristic=heuristic, max_retries=max_retries, pool_maxsize=pool_maxsize))
+    stats = CacheStats(policies)
+    sess.hooks['response'].append(stats.record)
+    return stats